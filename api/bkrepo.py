@@ -1,21 +1,46 @@
 import json
-from typing import Any, Optional, Dict
+import time
+import tempfile
+import threading
+from typing import Any, BinaryIO, Generator, Optional, Dict
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
 from settings import (
-    BK_REPO_USERNAME, BK_REPO_PASSWORD, BK_REPO_ROOT
+    BK_REPO_USERNAME, BK_REPO_PASSWORD, BK_REPO_ROOT,
+    BK_REPO_CHUNK_SIZE, BK_REPO_SPOOL_SIZE, BK_REPO_RETRIES, BK_REPO_BACKOFF, BK_REPO_TIMEOUT,
+    BK_REPO_POOL_SIZE, BK_REPO_STAT_TTL, BK_REPO_STAT_MISS_TTL
 )
 from log import logger
 from exceptions import ActionFailed
+from utils.cache import LRUCache
 
 
 class BKRepo:
+    # shared by every instance in the process
+    _session = None
+    _lock = threading.Lock()
+    # abs path -> node metadata, {} means not exist
+    stat_cache = LRUCache(4096, ttl=BK_REPO_STAT_TTL, sizeof=lambda _: 1)
+
     def __init__(self):
         self.api_root = BK_REPO_ROOT
         self.basic = HTTPBasicAuth(BK_REPO_USERNAME, BK_REPO_PASSWORD)
 
+    @property
+    def session(self) -> requests.Session:
+        if BKRepo._session is None:
+            with BKRepo._lock:
+                if BKRepo._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=BK_REPO_POOL_SIZE, pool_maxsize=BK_REPO_POOL_SIZE)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    BKRepo._session = session
+        return BKRepo._session
+
     def _handle_api_result(self, result: Optional[Dict[str, Any]]) -> Any:
         if isinstance(result, dict):
             if result.get('result', False) or result.get('code', 0) == 0:
@@ -27,7 +52,11 @@ class BKRepo:
         params.update({'auth': self.basic})
 
         url = f"{self.api_root}/{action}"
-        response = getattr(requests, method)(url, **params)
+        params.setdefault('timeout', BK_REPO_TIMEOUT)
+        response = getattr(self.session, method)(url, **params)
+        # binary bodies are returned untouched, stream=True ones are not read here
+        if 'json' not in response.headers.get('Content-Type', ''):
+            return response
         try:
             return self._handle_api_result(response.json())
         except (TypeError, json.JSONDecodeError):
@@ -43,7 +72,107 @@ class BKRepo:
         return self.call_action(f'generic/{project}/{repo}/{abs_path}?download=true',
                                 'get', **params)
 
-    def search(self, rule: Dict):
+    def download_buffer(self, project: str, repo: str, abs_path: str,
+                        chunk_size: int = BK_REPO_CHUNK_SIZE,
+                        max_memory: int = BK_REPO_SPOOL_SIZE,
+                        retries: int = BK_REPO_RETRIES) -> BinaryIO:
+        """
+        stream into a spooled temp file, kept in memory up to max_memory then on disk
+        a broken transfer is resumed from the written offset with http range, after an exponential backoff
+        """
+        buffer = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        url = f"{self.api_root}/generic/{project}/{repo}/{abs_path}?download=true"
+        failures = 0
+        while True:
+            offset = buffer.tell()
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                with self.session.get(url, auth=self.basic, headers=headers, stream=True,
+                                  timeout=BK_REPO_TIMEOUT) as response:
+                    if offset and response.status_code == 416:
+                        break
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        # range not honored, start over
+                        buffer.seek(0)
+                        buffer.truncate()
+                    for chunk in response.iter_content(chunk_size):
+                        buffer.write(chunk)
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                failures += 1
+                logger.error(f'download {abs_path} interrupted at {buffer.tell()}: {e}')
+                if failures > retries:
+                    buffer.close()
+                    raise ActionFailed
+                time.sleep(BK_REPO_BACKOFF * 2 ** (failures - 1))
+            except requests.HTTPError as e:
+                logger.error(f'download {abs_path} error: {e}')
+                buffer.close()
+                raise ActionFailed
+        buffer.seek(0)
+        return buffer
+
+    def download_range(self, project: str, repo: str, abs_path: str, start: int, size: int) -> bytes:
+        """
+        bytes [start, start + size) of a generic node, sliced from the stream if range is not honored
+        """
+        url = f"{self.api_root}/generic/{project}/{repo}/{abs_path}?download=true"
+        end = start + size
+        with self.session.get(url, auth=self.basic, headers={'Range': f'bytes={start}-{end - 1}'},
+                              stream=True, timeout=BK_REPO_TIMEOUT) as response:
+            if not response.ok:
+                logger.error(f'download {abs_path} error: {response.status_code}')
+                raise ActionFailed
+            if response.status_code == 206:
+                return response.content
+            data, offset = bytearray(), 0
+            for chunk in response.iter_content(BK_REPO_CHUNK_SIZE):
+                data += chunk[max(start - offset, 0):max(end - offset, 0)]
+                offset += len(chunk)
+                if offset >= end:
+                    break
+            return bytes(data)
+
+    def stat(self, project: str, repo: str, abs_path: str) -> Optional[Dict]:
+        """
+        metadata of one generic node by HEAD, None if not exist
+        cached, finished artifacts do not change, missing ones are rechecked sooner
+        """
+        key = f'{project}/{repo}/{abs_path}'
+        node = self.stat_cache.get(key)
+        if node is not None:
+            return node or None
+        response = self.session.head(f"{self.api_root}/generic/{key}", auth=self.basic,
+                                     timeout=BK_REPO_TIMEOUT)
+        if response.status_code == 404:
+            self.stat_cache.set(key, {}, ttl=BK_REPO_STAT_MISS_TTL)
+            return None
+        if not response.ok:
+            logger.error(f'stat {key} error: {response.status_code}')
+            raise ActionFailed
+        node = {'size': int(response.headers.get('Content-Length', 0)),
+                'etag': response.headers.get('ETag', '').strip('"'),
+                'last_modified': response.headers.get('Last-Modified', '')}
+        self.stat_cache.set(key, node)
+        return node
+
+    def search_all(self, rule: Dict, page_size: int = 1000) -> Generator[Dict, None, None]:
+        """
+        every node matching rule, page by page
+        """
+        page_number = 1
+        while True:
+            data = self.search(rule, page_number, page_size) or {}
+            records = data.get('records', [])
+            yield from records
+            total = data.get('totalRecords', data.get('count', 0))
+            if len(records) < page_size or page_number * page_size >= total:
+                return
+            page_number += 1
+
+    def search(self, rule: Dict, page_number: int = 1, page_size: int = 1000):
         """
         {
             "page":{
@@ -79,7 +208,7 @@ class BKRepo:
         return self.call_action('repository/api/node/search',
                                 'post',
                                 json={
-                                    "page": {"pageNumber": 1, "pageSize": 1000},
+                                    "page": {"pageNumber": page_number, "pageSize": page_size},
                                     "sort": {"properties": ["folder", "lastModifiedDate"],
                                              "direction": "DESC"},
                                     "rule": rule
@@ -1,13 +1,192 @@
 import json
-from typing import Dict
+import uuid
+import zlib
+import asyncio
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Optional
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 from requests_oauth2 import OAuth2BearerToken
+from urllib3.util.retry import Retry
 
-from settings import DOLPH_ROOT, DOLPH_TOKEN
+from settings import (
+    DOLPH_ROOT, DOLPH_TOKEN, DOLPH_POOL_SIZE, DOLPH_TIMEOUT, DOLPH_RETRIES,
+    DOLPH_CONCURRENCY, DOLPH_CHUNK_SIZE
+)
 from log import logger
 
 
+def multipart_stream(boundary: str, fields: Dict, file: BinaryIO, filename: str,
+                     chunk_size: int = DOLPH_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    multipart/form-data body, file content is read chunk by chunk
+    """
+    for name, value in fields.items():
+        value = value if isinstance(value, str) else json.dumps(value)
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+               f'{value}\r\n').encode('utf-8')
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+           f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
+def gzip_stream(stream: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in stream:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class DolphClient:
+    """
+    keep-alive session shared by the whole process
+    only GET (task/{id}) is retried, posts may create duplicate tasks
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self,
+                 pool_size: int = DOLPH_POOL_SIZE,
+                 timeout: float = DOLPH_TIMEOUT,
+                 retries: int = DOLPH_RETRIES):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = OAuth2BearerToken(DOLPH_TOKEN)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries,
+                                                backoff_factor=0.5,
+                                                status_forcelist=(429, 500, 502, 503, 504),
+                                                allowed_methods=frozenset(['GET']),
+                                                raise_on_status=False))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def instance(cls) -> 'DolphClient':
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def request(self, headers: Dict, function: str, method: str = 'post', **params) -> Dict:
+        logger.info(f'headers: {headers}')
+        try:
+            if method == 'post':
+                response = self.session.post(f'{DOLPH_ROOT}/{function}/',
+                                             headers=headers,
+                                             data=json.dumps(params),
+                                             timeout=self.timeout)
+            else:
+                response = self.session.get(f'{DOLPH_ROOT}/{function}/',
+                                            headers=headers,
+                                            params=json.dumps(params),
+                                            timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f'dolph {function} error: {e}')
+            return {}
+        try:
+            return response.json()
+        except json.JSONDecodeError:
+            return {}
+
+    def upload(self, headers: Dict, function: str, file: BinaryIO, filename: str,
+               gzip: bool = False, **params) -> Dict:
+        """
+        binary upload, body is sent with chunked transfer encoding straight from file
+        """
+        boundary = uuid.uuid4().hex
+        headers = dict(headers, **{'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        body = multipart_stream(boundary, params, file, filename)
+        if gzip:
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip_stream(body)
+        try:
+            response = self.session.post(f'{DOLPH_ROOT}/{function}/',
+                                         headers=headers,
+                                         data=body,
+                                         timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f'dolph {function} error: {e}')
+            return {}
+        try:
+            return response.json()
+        except json.JSONDecodeError:
+            return {}
+
+
+class AsyncDolphClient:
+    """
+    async with AsyncDolphClient() as client:
+        results = await client.translate_many(headers, [{'text': ...}, ...])
+    """
+
+    def __init__(self,
+                 concurrency: int = DOLPH_CONCURRENCY,
+                 timeout: float = DOLPH_TIMEOUT,
+                 pool_size: int = DOLPH_POOL_SIZE):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> 'AsyncDolphClient':
+        self.session = aiohttp.ClientSession(
+            headers={'Authorization': f'Bearer {DOLPH_TOKEN}'},
+            connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    async def request(self, headers: Dict, function: str, method: str = 'post',
+                      timeout: float = None, **params) -> Dict:
+        kwargs = {'data': json.dumps(params)} if method == 'post' else {'params': json.dumps(params)}
+        async with self.semaphore:
+            try:
+                async with self.session.request(method.upper(), f'{DOLPH_ROOT}/{function}/',
+                                                headers=headers,
+                                                timeout=aiohttp.ClientTimeout(total=timeout or self.timeout),
+                                                **kwargs) as response:
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+                logger.error(f'dolph {function} error: {e!r}')
+                return {}
+
+    async def translate_many(self, headers: Dict, items: List[Dict],
+                             function: str = 'text/translate', method: str = 'post',
+                             timeout: float = None) -> List[Dict]:
+        """
+        results are in input order, cancelling the caller cancels every pending request
+        """
+        return await asyncio.gather(*[self.request(headers, function, method, timeout, **item)
+                                      for item in items])
+
+
+def translate_many(headers: Dict,
+                   items: List[Dict],
+                   function: str = 'text/translate',
+                   method: str = 'post',
+                   concurrency: int = DOLPH_CONCURRENCY) -> List[Dict]:
+    """
+    blocking entry for streamlit script thread
+    """
+    async def run():
+        async with AsyncDolphClient(concurrency) as client:
+            return await client.translate_many(headers, items, function, method)
+    return asyncio.run(run())
+
+
 def translate(headers: Dict,
               function: str = 'translate',
               method: str = 'post',
@@ -19,20 +198,13 @@ def translate(headers: Dict,
     file_name
     extract_type
     """
-    with requests.Session() as client:
-        client.auth = OAuth2BearerToken(DOLPH_TOKEN)
-        # client.headers = {'Content-Type': 'application/json'}
-        client.headers.update(headers)
-        logger.info(f'headers: {headers}')
-        if method == 'post':
-            response = client.post(f'{DOLPH_ROOT}/{function}/',
-                                   headers=headers,
-                                   data=json.dumps(params))
-        else:
-            response = client.get(f'{DOLPH_ROOT}/{function}/',
-                                  headers=headers,
-                                  params=json.dumps(params))
-        try:
-            return response.json()
-        except json.JSONDecodeError:
-            return {}
+    return DolphClient.instance().request(headers, function, method, **params)
+
+
+def upload(headers: Dict,
+           function: str,
+           file: BinaryIO,
+           filename: str,
+           gzip: bool = False,
+           **params):
+    return DolphClient.instance().upload(headers, function, file, filename, gzip, **params)
@@ -1,5 +1,8 @@
 import json
-from typing import Dict
+import time
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
 from tencentcloud.common import credential
 from tencentcloud.common.profile.client_profile import ClientProfile
@@ -9,7 +12,8 @@ from tencentcloud.tmt.v20180321 import tmt_client, models
 
 from log import logger
 from settings import (
-    QCLOUD_SECRET_ID as SECRET_ID, QCLOUD_SECRET_KEY as SECRET_KEY
+    QCLOUD_SECRET_ID as SECRET_ID, QCLOUD_SECRET_KEY as SECRET_KEY,
+    QCLOUD_TMT_QPS, QCLOUD_TMT_RETRIES
 )
 
 
@@ -31,8 +35,10 @@ class QCloud:
                 return {}
         return wrapper
 
-    @post_handle
-    def handle_request(self, service: str, client, **kwargs):
+    def call(self, service: str, client, **kwargs):
+        """
+        same as handle_request, but sdk errors are raised to caller
+        """
         req = getattr(models, f'{service}Request')()
         req.from_json_string(json.dumps(kwargs))
         resp = getattr(client, service)(req)
@@ -41,6 +47,10 @@ class QCloud:
         except json.JSONDecodeError:
             return {}
 
+    @post_handle
+    def handle_request(self, service: str, client, **kwargs):
+        return self.call(service, client, **kwargs)
+
 
 class Tmt(QCloud):
     PRODUCT = 'tmt'
@@ -57,3 +67,134 @@ class Tmt(QCloud):
         "ProjectId": 0
         """
         return self.handle_request('TextTranslate', self.client,  **kwargs)
+
+
+@lru_cache(maxsize=None)
+def get_tmt(region: str = 'ap-beijing') -> Tmt:
+    """
+    one client per region for the whole process
+    """
+    return Tmt(region)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        # below 1 qps a bucket of rate tokens could never hold one request
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TmtBatch:
+    """
+    pack segments into TextTranslateBatch requests
+    api limit: total length of one request < 6000 characters, default 5 qps per account
+    """
+    MAX_CHARS = 6000
+    MAX_ITEMS = 100
+    THROTTLED = ('RequestLimitExceeded', 'RequestLimitExceeded.UserLimitExceeded', 'LimitExceeded')
+    _buckets: Dict[str, TokenBucket] = {}
+
+    def __init__(self, region: str = 'ap-beijing', qps: float = QCLOUD_TMT_QPS,
+                 retries: int = QCLOUD_TMT_RETRIES):
+        self.tmt = get_tmt(region)
+        self.retries = retries
+        # the qps quota is per account, share the bucket between instances
+        self.bucket = self._buckets.setdefault(region, TokenBucket(qps))
+
+    def split(self, text: str) -> List[Tuple[str, str]]:
+        """
+        cut text longer than MAX_CHARS, at line breaks if possible
+        return (separator before piece, piece)
+        """
+        pieces, current, sep = [], None, ''
+        for line in text.split('\n'):
+            line_sep = '\n' if current is not None or pieces else ''
+            while len(line) > self.MAX_CHARS:
+                if current is not None:
+                    pieces.append((sep, current))
+                    current = None
+                pieces.append((line_sep, line[:self.MAX_CHARS]))
+                line, line_sep = line[self.MAX_CHARS:], ''
+            if current is None:
+                current, sep = line, line_sep
+            elif len(current) + len(line) + 1 > self.MAX_CHARS:
+                pieces.append((sep, current))
+                current, sep = line, '\n'
+            else:
+                current = f'{current}\n{line}'
+        pieces.append((sep, current))
+        return pieces
+
+    def pack(self, pieces: List[str]) -> List[List[int]]:
+        batches, batch, size = [], [], 0
+        for i, piece in enumerate(pieces):
+            if not piece.strip():
+                continue
+            if batch and (size + len(piece) > self.MAX_CHARS or len(batch) >= self.MAX_ITEMS):
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(i)
+            size += len(piece)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def request(self, texts: List[str], source: str, target: str, project_id: int) -> Optional[List[str]]:
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                result = self.tmt.call('TextTranslateBatch', self.tmt.client,
+                                       Source=source, Target=target, ProjectId=project_id,
+                                       SourceTextList=texts)
+                return result.get('TargetTextList')
+            except TencentCloudSDKException as e:
+                if e.get_code() not in self.THROTTLED or attempt == self.retries:
+                    logger.error(f'TextTranslateBatch error: {len(texts)} items {e}')
+                    return None
+                time.sleep(0.5 * 2 ** attempt)
+
+    def translate(self, texts: List[str], source: str = 'auto', target: str = 'zh',
+                  project_id: int = 0) -> List[Optional[str]]:
+        """
+        result is in input order, None for the segments whose sub-batch failed
+        """
+        pieces, owner = [], []
+        for i, text in enumerate(texts):
+            if not text.strip():
+                continue
+            for sep, piece in self.split(text):
+                pieces.append(piece)
+                owner.append((i, sep))
+        translated = [None if piece.strip() else piece for piece in pieces]
+        for batch in self.pack(pieces):
+            result = self.request([pieces[i] for i in batch], source, target, project_id)
+            if result is None or len(result) != len(batch):
+                continue
+            for i, text in zip(batch, result):
+                translated[i] = text
+
+        output: List[Optional[str]] = [text if not text.strip() else '' for text in texts]
+        failed = set()
+        for (i, sep), text in zip(owner, translated):
+            if text is None:
+                failed.add(i)
+            else:
+                output[i] += f'{sep}{text}'
+        for i in failed:
+            output[i] = None
+        return output
@@ -1,21 +1,26 @@
+import io
 import os
-import json
 import time
-from typing import Tuple
+from typing import Dict, List, Tuple
 
 import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 from streamlit.delta_generator import DeltaGenerator
-from langdetect import detect
 
-from settings import DOMAIN, LANGUAGE, MODEL
+from settings import DOMAIN, LANGUAGE, MODEL, UPLOAD_FILE_TYPES, DOLPH_UPLOAD_MODE, DOLPH_UPLOAD_GZIP
 from elements.magic import (
     post_compile, Login, nav_page
 )
-from api.dolph import translate
+from api.dolph import translate, upload
 from exceptions import LoginFailedError
 from utils.stdlib import Tool
+from utils.memory import TranslationMemory, TEXT_CACHE, TEXT_FLIGHT
 from utils.parser import FileParser
+from utils.record import RecordStore
+from utils.poller import TaskPoller
+from utils.glossary import Glossary
+from utils.matcher import TermMatcher
+from utils.lang import LanguageDetector
 from log import logger
 
 APP_CODE = os.getenv('BKPAAS_APP_ID')
@@ -31,9 +36,25 @@ class Engine(Login, Tool):
         self.language = ''
         self.model = ''
         self.term = ''
+        self.tm = TranslationMemory(self.rc)
 
     def get_term(self):
-        return self.rc.redis_client.hkeys(f'{APP_CODE}:{APP_ENV}:term:{self.project}')
+        return Glossary(self.rc, self.project).names()
+
+    def term_signature(self) -> List[str]:
+        """
+        selected glossaries with version, changes whenever an entry changes
+        """
+        versions = Glossary(self.rc, self.project).versions(self.term)
+        return [f'{name}@{version}' for name, version in versions.items()]
+
+    def term_entries(self, text: str) -> Dict[str, str]:
+        """
+        only the selected terms that occur in text
+        """
+        if not self.term:
+            return {}
+        return TermMatcher(Glossary(self.rc, self.project)).match(self.term, text)
 
     def menu(self):
         st.sidebar.text(self.username)
@@ -56,7 +77,7 @@ class Engine(Login, Tool):
         with input_col1:
             user_input = st.text_area('Your input', height=30)
             if user_input != '':
-                language = detect(user_input)
+                language = LanguageDetector.detect(user_input)
                 st.write(f'Lang:  {language}')
 
         with input_col2:
@@ -64,32 +85,57 @@ class Engine(Login, Tool):
             output = ''
             if user_input != '':
                 status = 'translating...'
-                response = translate({'bk_ticket': self.bk_ticket},
-                                     'text/translate',
-                                     text=user_input,
-                                     translate_type=self.model,
-                                     term=self.term,
-                                     project=self.project)
-                output = response.get('data', {}).get('result')
+                key = ('translate', user_input, self.model, self.language,
+                       tuple(sorted(self.term_signature())), self.project)
+                output = TEXT_CACHE.get(key)
+                if output is None:
+                    output = TEXT_FLIGHT.do(key, self._translate, user_input)
+                    if output is not None:
+                        TEXT_CACHE.set(key, output)
                 if output is None:
                     output = 'no response'
                     msg.error('the backend api error...')
             st.text_area('Chinese', output, placeholder=status)
 
-    def file_translate(self, filename: str, extract_type: str, pure_text: str, bytes_data: bytes):
+    def _translate(self, user_input: str):
+        terms = self.term_signature()
+        output = self.tm.get(self.project, self.model, self.language, terms, user_input)
+        if output is None:
+            response = translate({'bk_ticket': self.bk_ticket},
+                                 'text/translate',
+                                 text=user_input,
+                                 translate_type=self.model,
+                                 term=self.term,
+                                 term_entries=self.term_entries(user_input),
+                                 project=self.project)
+            output = response.get('data', {}).get('result')
+            if output is not None:
+                self.tm.set(self.project, self.model, self.language, terms, user_input, output)
+        return output
+
+    def file_translate(self, filename: str, extract_type: str, pure_text: str, bytes_data: bytes,
+                       source_language: str):
         params = {
+            "source_language": source_language,
             "term": self.term,
+            "term_entries": self.term_entries(pure_text),
             "project": self.project,
             "extract_type": extract_type,
             "file_name": filename,
-            "file": bytes_data.decode('latin-1'),
             "translate_type": self.model
         }
-        response = translate({'bk_ticket': self.bk_ticket}, 'file/translate', **params)
+        if DOLPH_UPLOAD_MODE == 'multipart':
+            response = upload({'bk_ticket': self.bk_ticket}, 'file/translate',
+                              io.BytesIO(bytes_data), filename, DOLPH_UPLOAD_GZIP, **params)
+        else:
+            params['file'] = bytes_data.decode('latin-1')
+            response = translate({'bk_ticket': self.bk_ticket}, 'file/translate', **params)
         logger.error(response)
         params.update({'pure_text': pure_text, 'response': response.get('data', {})})
-        self.rc.hash_set(f'{APP_CODE}:{APP_ENV}:record:{self.project}:{self.username}',
-                         time.strftime('%Y-%m-%d %H:%M:%S'), json.dumps(params))
+        store = RecordStore(self.rc, self.project, self.username)
+        store.add(time.strftime(RecordStore.TIME_FORMAT), params)
+        store.apply_retention()
+        TaskPoller.start(self.rc)
         return
 
     def file_parse(self, uploaded_file: UploadedFile, msg: DeltaGenerator) -> Tuple:
@@ -99,8 +145,9 @@ class Engine(Login, Tool):
             filename = uploaded_file.name
             parser = FileParser(uploaded_file.name)
             extract_type = parser.filetype
-            pure_text = parser.tostring(bytes_data)
-            return filename, extract_type, pure_text, bytes_data
+            pure_text = self.parse_text(parser, bytes_data, msg)
+            source_language = LanguageDetector.detect(pure_text) if pure_text else LanguageDetector.UNKNOWN
+            return filename, extract_type, pure_text, bytes_data, source_language
         return None
 
     def render(self):
@@ -109,7 +156,7 @@ class Engine(Login, Tool):
         if self.input_type == 'Text':
             self.text_translate()
         elif self.input_type == 'File':
-            uploaded_file = st.file_uploader("Choose a file", type=['xlsx', 'docx', 'pdf', 'txt'])
+            uploaded_file = st.file_uploader("Choose a file", type=UPLOAD_FILE_TYPES)
             msg = st.empty()
             if st.button('Submit', use_container_width=True):
                 file_info = self.file_parse(uploaded_file, msg)
@@ -0,0 +1,60 @@
+"""
+compression ratio and throughput of RedisClient codecs on record sized payloads, run from project root:
+    python -m benchmarks.codec [pure_text_mb]
+"""
+import io
+import os
+import sys
+import time
+import random
+import zipfile
+
+from utils.db import Codec, zstandard
+
+
+def fixture(size_mb: int) -> dict:
+    """
+    a record payload: parsed text of a spreadsheet, the latin-1 upload and backend response
+    """
+    random.seed(0)
+    words = ['아이템', '퀘스트', '완료', '보상', 'item', 'quest', 'reward', 'level', '레벨', '{0}', '%d']
+    lines, size = [], 0
+    while size < size_mb * 1024 * 1024:
+        line = ' '.join(random.choice(words) for _ in range(random.randint(3, 20))) + f' {random.randint(0, 99999)}'
+        lines.append(line)
+        size += len(line.encode('utf-8')) + 1
+    pure_text = '\n'.join(lines)
+    upload = io.BytesIO()
+    with zipfile.ZipFile(upload, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('xl/sharedStrings.xml', pure_text)
+    return {'file': upload.getvalue().decode('latin-1'), 'pure_text': pure_text,
+            'response': {'task_id': os.urandom(16).hex()}, 'term': ['ui.xlsx']}
+
+
+def bench(codec: Codec, payload: dict, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = codec.encode(payload)
+    encode = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        codec.decode(data)
+    decode = (time.perf_counter() - start) / repeat
+    return len(data), encode, decode
+
+
+def main(size_mb: int = 5, repeat: int = 3):
+    payload = fixture(size_mb)
+    raw = len(Codec('json').encode(payload))
+    print(f'plain json {raw / 2 ** 20:.1f} MB')
+    cases = [('json', 0), ('zlib', 1), ('zlib', 6), ('zlib', 9)]
+    if zstandard is not None:
+        cases += [('zstd', 1), ('zstd', 3), ('zstd', 9)]
+    for name, level in cases:
+        size, encode, decode = bench(Codec(name, level), payload, repeat)
+        print(f'{name:<5} level {level}  ratio {raw / size:5.2f}  '
+              f'encode {raw / encode / 2 ** 20:7.1f} MB/s  decode {raw / decode / 2 ** 20:7.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,33 @@
+"""
+cold start cost of utils.parser, run from project root:
+    python benchmarks/import_time.py
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+CASES = {
+    'utils.parser (lazy)': 'import utils.parser',
+    'eager backends (before)': 'import pandas, numpy, openpyxl, PyPDF2, docx; import utils.parser',
+    'utils.parser + txt parse': "from utils.parser import FileParser; FileParser('a.txt').tostring(b'a')",
+}
+
+
+def measure(code: str, repeat: int) -> float:
+    cost = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        cost.append(time.perf_counter() - start)
+    return statistics.median(cost)
+
+
+def main(repeat: int = 5):
+    baseline = measure('pass', repeat)
+    for name, code in CASES.items():
+        print(f'{name:<28} {(measure(code, repeat) - baseline) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,46 @@
+"""
+peak memory of building the file/translate request body, run from project root:
+    python -m benchmarks.upload_memory [size_mb]
+"""
+import io
+import os
+import sys
+import json
+import tracemalloc
+
+from api.dolph import multipart_stream, gzip_stream
+
+
+def json_body(data: bytes) -> int:
+    params = {'file_name': 'bench.xlsx', 'file': data.decode('latin-1')}
+    # requests/urllib3 encode the str body before sending
+    return len(json.dumps(params).encode('utf-8'))
+
+
+def multipart_body(data: bytes, gzip: bool = False) -> int:
+    body = multipart_stream('bench', {'file_name': 'bench.xlsx'}, io.BytesIO(data), 'bench.xlsx')
+    if gzip:
+        body = gzip_stream(body)
+    return sum(len(chunk) for chunk in body)
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    size = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, peak
+
+
+def main(size_mb: int = 50):
+    # half random, half text-like, close to a real xlsx/docx payload
+    data = os.urandom(size_mb * 512 * 1024) + b'translate me ' * (size_mb * 512 * 1024 // 13)
+    for name, func, args in (('json latin-1 (before)', json_body, (data,)),
+                             ('multipart stream', multipart_body, (data,)),
+                             ('multipart stream gzip', multipart_body, (data, True))):
+        size, peak = measure(func, *args)
+        print(f'{name:<24} body {size / 2 ** 20:8.1f} MB  peak {peak / 2 ** 20:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
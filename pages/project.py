@@ -1,7 +1,7 @@
 import os
-import json
 
 import streamlit as st
+from redis.exceptions import WatchError
 
 from settings import WHITE_MEMBERS, DOMAIN
 from elements.magic import Login, post_compile
@@ -43,14 +43,15 @@ class Project(Login, Tool):
             if submitted:
                 msg = st.empty()
                 msg.info('Creating...')
-                if self.rc.redis_client.hexists(f'{APP_CODE}:{APP_ENV}:project', project_name):
+                members.append(self.username)
+                try:
+                    created = self.add_project(project_name, list(set(members)), self.username)
+                except WatchError:
+                    msg.error('Project list changed, plz submit again...')
+                    return
+                if not created:
                     msg.error('Project name exist...')
                     return
-                members.append(self.username)
-                self.rc.hash_set(f'{APP_CODE}:{APP_ENV}:project',
-                                 project_name,
-                                 json.dumps({'project_name': project_name, 'members': list(set(members)),
-                                             'creator': self.username}))
                 msg.success('Created')
 
     def data(self):
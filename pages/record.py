@@ -1,6 +1,5 @@
 import os
-import json
-from typing import Dict, List, Generator
+from typing import BinaryIO, Dict, List, Generator, Union
 
 import pandas as pd
 import streamlit as st
@@ -15,10 +14,15 @@ from api.dolph import translate as check_translate_status
 from log import logger
 from utils.stdlib import Tool
 from utils.parser import FileParser
+from utils.record import RecordStore
+from utils.diff import TextDiff, get_diff, set_diff
+from utils.artifact import ARTIFACTS
+from utils.poller import TaskPoller
 from settings import SUPERUSER, WHITE_MEMBERS, DOMAIN
 
 APP_CODE = os.getenv('BKPAAS_APP_ID')
 APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
+PAGE_SIZE = 10
 
 
 class Record(Login, Tool):
@@ -28,24 +32,21 @@ class Record(Login, Tool):
         self.project = ''
         self.query = self.username
 
-    def get_record_list(self) -> Generator:
-        data = self.rc.redis_client.hgetall(f'{APP_CODE}:{APP_ENV}:record:{self.project}:{self.query}')
-        for k, v in data.items():
-            try:
-                detail = json.loads(v)
-            except json.JSONDecodeError:
-                continue
-            yield {'time': k, 'filename': detail['file_name'], 'status': detail.get('status', 'PENDING')}
+    @property
+    def store(self) -> RecordStore:
+        return RecordStore(self.rc, self.project, self.query)
+
+    def get_record_list(self, offset: int = 0, limit: int = PAGE_SIZE, query: str = '') -> Generator:
+        metas = self.store.search_page(query, offset, limit) if query else self.store.list(offset, limit)
+        for meta in metas:
+            yield {'time': meta['time'], 'filename': meta.get('file_name', ''),
+                   'status': meta.get('status', 'PENDING')}
 
     def get_record(self, key: str) -> Dict:
-        data = self.rc.hash_get(f'{APP_CODE}:{APP_ENV}:record:{self.project}:{self.query}', key)
-        try:
-            return json.loads(data)
-        except json.JSONDecodeError:
-            return {}
+        return self.store.get(key)
 
-    def set_record(self, key, data):
-        self.rc.hash_set(f'{APP_CODE}:{APP_ENV}:record:{self.project}:{self.query}', key, json.dumps(data))
+    def set_status(self, key: str, status: str):
+        self.store.update_meta(key, status=status)
 
     def sidebar(self):
         st.sidebar.title('Project')
@@ -80,20 +81,23 @@ class Record(Login, Tool):
 
     def file_list(self, reload_data=False):
         with st.spinner('Wait for loading...'):
-            data = sorted(self.get_record_list(), key=lambda x: x['time'], reverse=True) or []
-            if not data:
+            # searched on server, grid only holds the current page
+            query = st.sidebar.text_input('Filename').strip()
+            total = len(self.store.search(query)) if query else self.store.count()
+            if not total:
                 st.warning('No Record')
                 return
-            data = pd.DataFrame(data)
+            pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+            page = st.sidebar.number_input(f'Page (total {pages})', min_value=1, max_value=pages, value=1)
+            data = pd.DataFrame(self.get_record_list((page - 1) * PAGE_SIZE, PAGE_SIZE, query))
 
             gb = GridOptionsBuilder.from_dataframe(data)
             gb.configure_selection(selection_mode='single')
             gb.configure_auto_height()
             gb.configure_side_bar()
-            gb.configure_pagination(paginationAutoPageSize=False, paginationPageSize=10)
             go = gb.build()
             return_ag = AgGrid(data,
-                               enable_quicksearch=True,
+                               enable_quicksearch=False,
                                gridOptions=go,
                                allow_unsafe_jscode=True,
                                reload_data=reload_data,
@@ -123,36 +127,66 @@ class Record(Login, Tool):
 
     def file_diff(self, record: Dict, msg: DeltaGenerator):
         raw = self.get_record(record['time'])
+        if 'pure_text' not in raw:
+            msg.error('Record content is not available, archive may be lost...')
+            return
         bk_repo = BKRepo()
-        data = bk_repo.search({
-            "rules": [
-                {"field": "projectId", "value": "opsbot2", "operation": "EQ"},
-                {"field": "repoName", "value": "translate", "operation": "EQ"},
-                {"field": "path", "value": "/target/", "operation": "EQ"},
-                {"field": "name", "value": raw['file_name'], "operation": "EQ"}
-            ],
-            "relation": "AND"
-        })
-
-        if data['count'] == 0:
+        node = bk_repo.stat('opsbot2', 'translate', f"target/{raw['file_name']}")
+
+        if node is None:
             status = self._status_handle(raw, msg)
         else:
             msg.success('Translated')
             status = 'SUCCESS'
-            response = bk_repo.download('opsbot2', 'translate', f"target/{raw['file_name']}", stream=True)
-            bytes_data = response.content
-            parser = FileParser()
-            parser.filetype = raw['extract_type']
-            new_text = parser.tostring(bytes_data)
-            # mv download link to bkrepo
-            self.file_download(record['filename'], raw['extract_type'], bytes_data)
-            diff_viewer.diff_viewer(old_text=raw['pure_text'],
-                                    new_text=new_text,
-                                    lang='python')
-        raw.update({'status': status})
-        self.set_record(record['time'], raw)
-
-    def file_download(self, filename: str, extract_type: str, data: bytes):
+            key = (self.store.prefix, record['time'], node['etag'] or node['size'])
+            file = ARTIFACTS.open(key)
+            if file is None:
+                with bk_repo.download_buffer('opsbot2', 'translate', f"target/{raw['file_name']}") as buffer:
+                    file = ARTIFACTS.put(key, buffer)
+            with file:
+                if get_diff(key) is None:
+                    new_text = ARTIFACTS.text(key)
+                    if new_text is None:
+                        parser = FileParser()
+                        parser.filetype = raw['extract_type']
+                        new_text = self.parse_text(parser, file, msg)
+                        ARTIFACTS.put_text(key, new_text)
+                        file.seek(0)
+                    set_diff(key, raw['pure_text'], new_text)
+                msg.success('Translated')
+                # mv download link to bkrepo
+                self.file_download(record['filename'], raw['extract_type'], file)
+            st.session_state['diff'] = key
+            st.session_state['diff_page'] = 1
+        self.set_status(record['time'], status)
+
+    @staticmethod
+    def _jump(diff: TextDiff, forward: bool):
+        index = st.session_state.get('diff_page', 1) - 1
+        target = diff.next_change(index) if forward else diff.prev_change(index)
+        if target is not None:
+            st.session_state['diff_page'] = target + 1
+
+    def diff_view(self, record: Dict):
+        """
+        one block of the cached diff per rerun, instead of whole documents
+        """
+        key = st.session_state.get('diff')
+        diff = get_diff(key) if key and key[:2] == (self.store.prefix, record['time']) else None
+        if diff is None:
+            return
+        col1, col2, col3 = st.columns([1, 1, 4])
+        with col1:
+            st.button('prev change', use_container_width=True, on_click=self._jump, args=(diff, False))
+        with col2:
+            st.button('next change', use_container_width=True, on_click=self._jump, args=(diff, True))
+        with col3:
+            index = st.number_input(f'Block (total {diff.blocks})', min_value=1, max_value=diff.blocks,
+                                    key='diff_page') - 1
+        old_text, new_text = diff.page(index)
+        diff_viewer.diff_viewer(old_text=old_text, new_text=new_text, lang='python')
+
+    def file_download(self, filename: str, extract_type: str, data: Union[bytes, BinaryIO]):
         st.download_button(
             label="Press to download",
             data=data,
@@ -161,13 +195,13 @@ class Record(Login, Tool):
         )
 
     def stop(self, record: Dict, msg: DeltaGenerator):
-        raw = self.get_record(record['time'])
-        raw.update({'status': 'FAILURE'})
-        self.set_record(record['time'], raw)
+        self.set_status(record['time'], 'FAILURE')
 
     def render(self):
+        TaskPoller.start(self.rc)
         st.subheader('Record')
         self.sidebar()
+        self.store.apply_retention()
         msg = st.empty()
         toolbar = st.empty()
         selected_rows = self.file_list()
@@ -175,6 +209,8 @@ class Record(Login, Tool):
         if action == 'check':
             with st.spinner('parsing'):
                 self.file_diff(selected_rows[0], msg)
+        if selected_rows:
+            self.diff_view(selected_rows[0])
         if action == 'stop':
             self.stop(selected_rows[0], msg)
             st.experimental_rerun()
@@ -1,6 +1,5 @@
 import os
-import json
-from typing import List
+from itertools import islice
 
 import streamlit as st
 import pandas as pd
@@ -11,9 +10,11 @@ from elements.magic import Login, post_compile
 from exceptions import LoginFailedError
 from log import logger
 from utils.stdlib import Tool
+from utils.glossary import Glossary
 
 APP_CODE = os.getenv('BKPAAS_APP_ID')
 APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
+PREVIEW_SIZE = 50
 
 
 class Term(Login, Tool):
@@ -29,6 +30,10 @@ class Term(Login, Tool):
         project = tuple(self.get_project(self.username, 'project_name'))
         self.project = st.sidebar.selectbox('Project', project)
 
+    @property
+    def glossary(self) -> Glossary:
+        return Glossary(self.rc, self.project)
+
     def toolbar(self):
         with st.expander("Add"):
             if self.project == '':
@@ -38,15 +43,15 @@ class Term(Login, Tool):
                                                  help='only support xlsx')
                 if uploaded_file is not None:
                     msg = st.empty()
-                    msg.info('Upload...')
                     name = uploaded_file.name
-                    df = pd.read_excel(uploaded_file)
-                    st.table(df)
-                    if self.rc.redis_client.hexists(f'{APP_CODE}:{APP_ENV}:term:{self.project}', name):
+                    st.table(pd.DataFrame(islice(Glossary.read_xlsx(uploaded_file), PREVIEW_SIZE),
+                                          columns=['source', 'target']))
+                    if self.glossary.exists(name):
                         msg.warning(f'{name} will be override')
-                    else:
-                        msg.success('Uploaded')
-                    self.save(name, df.values.tolist())
+                    if st.button('Import', use_container_width=True):
+                        msg.info('Upload...')
+                        count = self.glossary.import_rows(name, Glossary.read_xlsx(uploaded_file), self.username)
+                        msg.success(f'Uploaded {count} terms')
 
     def data(self):
         hide_table_row_index = """
@@ -56,14 +61,45 @@ class Term(Login, Tool):
             </style>
         """
         st.markdown(hide_table_row_index, unsafe_allow_html=True)
-        data = self.rc.redis_client.hgetall(f'{APP_CODE}:{APP_ENV}:term:{self.project}')
-        st.table([{'name': name, 'user': self.username} for name in data.keys()])
-
-    def save(self, name: str, term: List[List[str]]):
-        # need to change to true kv mode
-        term = {item[0]: item[1] for item in term}
-        self.rc.hash_set(f'{APP_CODE}:{APP_ENV}:term:{self.project}',
-                         name, json.dumps(term))
+        names = self.glossary.names()
+        st.table(self.glossary.stats(names))
+        if names:
+            self.detail(st.selectbox('Glossary', names))
+
+    def detail(self, name: str):
+        """
+        paginated preview and incremental edit of one glossary
+        """
+        state_key = f'term_cursor:{self.project}:{name}'
+        cursors = st.session_state.setdefault(state_key, [0])
+        cursor, entries = self.glossary.page(name, cursors[-1], PREVIEW_SIZE)
+        st.table([{'source': k, 'target': v} for k, v in entries.items()])
+        col1, col2, _ = st.columns([1, 1, 6])
+        with col1:
+            if st.button('Prev', use_container_width=True, disabled=len(cursors) == 1):
+                cursors.pop()
+                st.experimental_rerun()
+        with col2:
+            if st.button('Next', use_container_width=True, disabled=cursor == 0):
+                cursors.append(cursor)
+                st.experimental_rerun()
+
+        with st.form('edit_term'):
+            source = st.text_input('Source')
+            target = st.text_input('Target')
+            add_col, remove_col, _ = st.columns([1, 1, 6])
+            with add_col:
+                add = st.form_submit_button('Add')
+            with remove_col:
+                remove = st.form_submit_button('Remove')
+            if add and source:
+                self.glossary.add(name, {source: target})
+                st.success(f'{source} added')
+            if remove and source:
+                if self.glossary.remove(name, [source]):
+                    st.success(f'{source} removed')
+                else:
+                    st.warning(f'{source} not found')
 
     def render(self):
         st.subheader('Term')
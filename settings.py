@@ -1,4 +1,6 @@
 import os
+import json
+import tempfile
 
 
 DOMAIN = os.getenv('DOMAIN', '')
@@ -6,6 +8,8 @@ WHITE_MEMBERS = os.getenv('WHITE_MEMBERS', '').split(',')
 LOGIN_URL = os.getenv('LOGIN_URL', '')
 LANGUAGE = os.getenv('LANGUAGE', 'ko,en').split(',')
 MODEL = os.getenv('MODEL', 'palm2,dolph,chatgpt,qcloud').split(',')
+# file types offered for translation, must be supported by dolph file/translate
+UPLOAD_FILE_TYPES = os.getenv('UPLOAD_FILE_TYPES', 'xlsx,docx,pdf,txt').split(',')
 
 REDIS_DB_NAME = os.getenv('REDIS_DB_NAME', '127.0.0.1')
 REDIS_DB_PASSWORD = os.getenv('REDIS_DB_PASSWORD', '')
@@ -22,3 +26,88 @@ DOLPH_ROOT = os.getenv('DOLPH_ROOT')
 DOLPH_TOKEN = os.getenv('DOLPH_TOKEN')
 
 SUPERUSER = os.getenv('SUPERUSER', 'neolei').split(',')
+
+PARSER_STREAM = os.getenv('PARSER_STREAM', 'true') == 'true'
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '0'))
+PDF_CHUNK_PAGES = int(os.getenv('PDF_CHUNK_PAGES', '16'))
+
+PARSE_CACHE_SIZE = int(os.getenv('PARSE_CACHE_SIZE', str(256 * 1024 * 1024)))
+PARSE_CACHE_REDIS = os.getenv('PARSE_CACHE_REDIS', 'false') == 'true'
+PARSE_CACHE_TTL = int(os.getenv('PARSE_CACHE_TTL', str(7 * 24 * 3600)))
+
+DOLPH_POOL_SIZE = int(os.getenv('DOLPH_POOL_SIZE', '10'))
+DOLPH_TIMEOUT = float(os.getenv('DOLPH_TIMEOUT', '60'))
+DOLPH_RETRIES = int(os.getenv('DOLPH_RETRIES', '3'))
+DOLPH_CONCURRENCY = int(os.getenv('DOLPH_CONCURRENCY', '8'))
+
+TM_TTL = int(os.getenv('TM_TTL', str(30 * 24 * 3600)))
+TEXT_CACHE_SIZE = int(os.getenv('TEXT_CACHE_SIZE', '2048'))
+TEXT_CACHE_TTL = int(os.getenv('TEXT_CACHE_TTL', '3600'))
+
+DOLPH_CHUNK_SIZE = int(os.getenv('DOLPH_CHUNK_SIZE', str(256 * 1024)))
+# json: latin-1 file embedded in json body, multipart: streamed binary upload
+DOLPH_UPLOAD_MODE = os.getenv('DOLPH_UPLOAD_MODE', 'json')
+DOLPH_UPLOAD_GZIP = os.getenv('DOLPH_UPLOAD_GZIP', 'false') == 'true'
+
+QCLOUD_TMT_QPS = float(os.getenv('QCLOUD_TMT_QPS', '5'))
+QCLOUD_TMT_RETRIES = int(os.getenv('QCLOUD_TMT_RETRIES', '3'))
+
+BK_REPO_CHUNK_SIZE = int(os.getenv('BK_REPO_CHUNK_SIZE', str(1024 * 1024)))
+BK_REPO_SPOOL_SIZE = int(os.getenv('BK_REPO_SPOOL_SIZE', str(16 * 1024 * 1024)))
+BK_REPO_RETRIES = int(os.getenv('BK_REPO_RETRIES', '3'))
+BK_REPO_BACKOFF = float(os.getenv('BK_REPO_BACKOFF', '0.5'))
+BK_REPO_TIMEOUT = float(os.getenv('BK_REPO_TIMEOUT', '60'))
+BK_REPO_POOL_SIZE = int(os.getenv('BK_REPO_POOL_SIZE', '10'))
+BK_REPO_STAT_TTL = int(os.getenv('BK_REPO_STAT_TTL', '600'))
+BK_REPO_STAT_MISS_TTL = int(os.getenv('BK_REPO_STAT_MISS_TTL', '10'))
+
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '200'))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', '30'))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '5'))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', '2'))
+
+# total automaton states kept, about 300 bytes each
+TERM_MATCHER_CACHE_STATES = int(os.getenv('TERM_MATCHER_CACHE_STATES', str(500 * 1000)))
+
+REDIS_LOCAL_CACHE_SIZE = int(os.getenv('REDIS_LOCAL_CACHE_SIZE', '10000'))
+REDIS_LOCAL_CACHE_TTL = int(os.getenv('REDIS_LOCAL_CACHE_TTL', '300'))
+# json / zlib / zstd(needs zstandard installed, fallback to zlib)
+REDIS_CODEC = os.getenv('REDIS_CODEC', 'zlib')
+REDIS_CODEC_LEVEL = int(os.getenv('REDIS_CODEC_LEVEL', '1'))
+REDIS_CODEC_MIN_SIZE = int(os.getenv('REDIS_CODEC_MIN_SIZE', '1024'))
+
+# filename search on record page covers the newest records only
+RECORD_SEARCH_WINDOW = int(os.getenv('RECORD_SEARCH_WINDOW', '1000'))
+
+# records older than RECORD_RETENTION_DAYS or beyond the newest RECORD_RETENTION_COUNT of a project/user
+# are archived to bkrepo, per project override: {"project": {"days": 90, "count": 500}}
+RECORD_RETENTION_DAYS = int(os.getenv('RECORD_RETENTION_DAYS', '30'))
+RECORD_RETENTION_COUNT = int(os.getenv('RECORD_RETENTION_COUNT', '200'))
+RECORD_RETENTION_PROJECTS = json.loads(os.getenv('RECORD_RETENTION_PROJECTS', '{}'))
+RECORD_RETENTION_INTERVAL = int(os.getenv('RECORD_RETENTION_INTERVAL', '3600'))
+RECORD_ARCHIVE_BATCH_SIZE = int(os.getenv('RECORD_ARCHIVE_BATCH_SIZE', str(64 * 1024 * 1024)))
+RECORD_ARCHIVE_PROJECT = os.getenv('RECORD_ARCHIVE_PROJECT', 'opsbot2')
+RECORD_ARCHIVE_REPO = os.getenv('RECORD_ARCHIVE_REPO', 'translate')
+RECORD_REHYDRATE_TTL = int(os.getenv('RECORD_REHYDRATE_TTL', str(24 * 3600)))
+
+TASK_POLL_INTERVAL = float(os.getenv('TASK_POLL_INTERVAL', '5'))
+TASK_POLL_MIN_DELAY = float(os.getenv('TASK_POLL_MIN_DELAY', '5'))
+TASK_POLL_MAX_DELAY = float(os.getenv('TASK_POLL_MAX_DELAY', '600'))
+TASK_POLL_BATCH = int(os.getenv('TASK_POLL_BATCH', '100'))
+TASK_POLL_LOCK_TTL = int(os.getenv('TASK_POLL_LOCK_TTL', '30'))
+# records polled this many times without a status change, or older than this, are marked UNKNOWN
+TASK_POLL_MAX_TRIES = int(os.getenv('TASK_POLL_MAX_TRIES', '30'))
+TASK_POLL_MAX_AGE = int(os.getenv('TASK_POLL_MAX_AGE', str(3 * 24 * 3600)))
+
+DIFF_BLOCK_LINES = int(os.getenv('DIFF_BLOCK_LINES', '200'))
+DIFF_CACHE_SIZE = int(os.getenv('DIFF_CACHE_SIZE', str(128 * 1024 * 1024)))
+
+ARTIFACT_CACHE_DIR = os.getenv('ARTIFACT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'gptranslate-artifacts'))
+ARTIFACT_CACHE_SIZE = int(os.getenv('ARTIFACT_CACHE_SIZE', str(2 * 1024 * 1024 * 1024)))
+
+LANG_DETECT_SEED = int(os.getenv('LANG_DETECT_SEED', '0'))
+LANG_SAMPLE_SIZE = int(os.getenv('LANG_SAMPLE_SIZE', '2000'))
+LANG_CACHE_SIZE = int(os.getenv('LANG_CACHE_SIZE', '4096'))
+
+# keep writing whole {source: target} json into term:{project} until the backend reads entry hashes
+GLOSSARY_LEGACY_BLOB = os.getenv('GLOSSARY_LEGACY_BLOB', 'true') == 'true'
@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Hashable, Optional
+
+from log import logger
+from settings import ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_SIZE
+
+
+class ArtifactCache:
+    """
+    downloaded artifacts on local disk, {digest}.bin with the parsed text next to it in {digest}.txt
+    lru by mtime, shared by every process on the host, bounded by total size of files
+    """
+
+    def __init__(self, root: str = ARTIFACT_CACHE_DIR, max_size: int = ARTIFACT_CACHE_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def path(self, key: Hashable, suffix: str = '.bin') -> str:
+        digest = hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()
+        return os.path.join(self.root, digest + suffix)
+
+    def open(self, key: Hashable) -> Optional[BinaryIO]:
+        """
+        opened file stays readable even if evicted meanwhile
+        """
+        path = self.path(key)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return file
+
+    def put(self, key: Hashable, data: BinaryIO) -> BinaryIO:
+        path = self.path(key)
+        self._write(path, lambda file: shutil.copyfileobj(data, file), 'wb')
+        self.evict()
+        return open(path, 'rb')
+
+    def text(self, key: Hashable) -> Optional[str]:
+        path = self.path(key, '.txt')
+        try:
+            with open(path, encoding='utf-8') as file:
+                text = file.read()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return text
+
+    def put_text(self, key: Hashable, text: str) -> None:
+        self._write(self.path(key, '.txt'), lambda file: file.write(text), 'w', encoding='utf-8')
+        self.evict()
+
+    def _write(self, path: str, write, mode: str, **kwargs) -> None:
+        # readers never see a partial file
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode, **kwargs) as file:
+                write(file)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """
+        drop least recently used files until under max size
+        """
+        with self._lock:
+            entries = []
+            if not os.path.isdir(self.root):
+                return
+            for entry in os.scandir(self.root):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                logger.info(f'artifact evicted {path}')
+
+
+ARTIFACTS = ArtifactCache()
@@ -1,16 +1,125 @@
 import os
 import json
+import zlib
+import threading
+from typing import Any, Callable, Dict, List, Union
 
 import redis
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 from log import logger
-from settings import REDIS_DB_NAME, REDIS_DB_PASSWORD, REDIS_DB_PORT
+from settings import (
+    REDIS_DB_NAME, REDIS_DB_PASSWORD, REDIS_DB_PORT,
+    REDIS_MAX_CONNECTIONS, REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_SOCKET_TIMEOUT, REDIS_SOCKET_CONNECT_TIMEOUT,
+    REDIS_LOCAL_CACHE_SIZE, REDIS_LOCAL_CACHE_TTL,
+    REDIS_CODEC, REDIS_CODEC_LEVEL, REDIS_CODEC_MIN_SIZE
+)
+from utils.cache import LRUCache
+
+APP_CODE = os.getenv('BKPAAS_APP_ID')
+APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
+INVALIDATE_CHANNEL = f'{APP_CODE}:{APP_ENV}:invalidate'
+
+
+class MeteredConnectionPool(redis.ConnectionPool):
+    """
+    connection pool with usage counters
+    """
+
+    def reset(self):
+        super(MeteredConnectionPool, self).reset()
+        self.checkouts = 0
+        self.peak_in_use = 0
+        self.exhausted = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        try:
+            connection = super(MeteredConnectionPool, self).get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            if self._created_connections >= self.max_connections:
+                self.exhausted += 1
+            raise
+        self.checkouts += 1
+        self.peak_in_use = max(self.peak_in_use, len(self._in_use_connections))
+        return connection
+
+    def stats(self) -> Dict:
+        return {
+            'max_connections': self.max_connections,
+            'created': self._created_connections,
+            'in_use': len(self._in_use_connections),
+            'idle': len(self._available_connections),
+            'peak_in_use': self.peak_in_use,
+            'checkouts': self.checkouts,
+            'exhausted': self.exhausted,
+        }
+
+
+class Codec:
+    """
+    value = header byte + body
+    0x00 plain json, 0x01 zlib json, 0x02 zstd json (only if zstandard is installed)
+    values without header (plain json, headerless zlib) are still readable
+    """
+    PLAIN = 0
+    ZLIB = 1
+    ZSTD = 2
+    NAMES = {'json': PLAIN, 'zlib': ZLIB, 'zstd': ZSTD}
+
+    def __init__(self, codec: str = REDIS_CODEC, level: int = REDIS_CODEC_LEVEL,
+                 min_size: int = REDIS_CODEC_MIN_SIZE):
+        self.codec = self.NAMES.get(codec, self.ZLIB)
+        if self.codec == self.ZSTD and zstandard is None:
+            self.codec = self.ZLIB
+        self.level = level
+        self.min_size = min_size
+
+    def encode(self, obj: Any) -> bytes:
+        body = json.dumps(obj).encode('utf-8')
+        if len(body) < self.min_size or self.codec == self.PLAIN:
+            return bytes([self.PLAIN]) + body
+        if self.codec == self.ZSTD:
+            return bytes([self.ZSTD]) + zstandard.ZstdCompressor(level=self.level).compress(body)
+        return bytes([self.ZLIB]) + zlib.compress(body, min(self.level, 9))
+
+    def decode(self, data: Union[bytes, str, None]) -> Any:
+        if data is None:
+            return None
+        if isinstance(data, str):
+            return json.loads(data)
+        header, body = data[0], data[1:]
+        if header == self.PLAIN:
+            return json.loads(body)
+        if header == self.ZLIB:
+            return json.loads(zlib.decompress(body))
+        if header == self.ZSTD:
+            if zstandard is None:
+                raise ValueError('zstd value found but zstandard is not installed')
+            return json.loads(zstandard.ZstdDecompressor().decompress(body))
+        try:
+            return json.loads(zlib.decompress(data))
+        except zlib.error:
+            return json.loads(data)
 
 
 class RedisClient:
     """
     redis操作
+    connection pools are shared by the whole process, one per (host, port, db, decode)
+    read through local cache: redis key -> {(command, args): value}, dropped on write
+    by any replica through INVALIDATE_CHANNEL
     """
+    _pools: Dict = {}
+    _lock = threading.Lock()
+    codec = Codec()
+    _local = LRUCache(REDIS_LOCAL_CACHE_SIZE, ttl=REDIS_LOCAL_CACHE_TTL, sizeof=lambda _: 1)
+    _subscriber = None
+    # bumped on every invalidation, a value loaded across an invalidation is not cached
+    _epoch = 0
 
     def __init__(self, db_name="0", env="dev"):
         self.db_name = db_name
@@ -19,20 +128,117 @@ class RedisClient:
             self.host = "localhost"
             self.password = ""
             self.port = 6379
-            self.redis_client = redis.Redis(
-                host=self.host, port=self.port, db=self.db_name, decode_responses=True
-            )
         else:
             self.host = REDIS_DB_NAME
             self.password = REDIS_DB_PASSWORD
             self.port = REDIS_DB_PORT
-            self.redis_client = redis.Redis(
-                host=self.host,
-                password=self.password,
-                port=self.port,
-                db=self.db_name,
-                decode_responses=True,
-            )
+        self.redis_client = redis.Redis(connection_pool=self.pool(decode_responses=True))
+        self._raw_client = None
+
+    @property
+    def raw_client(self) -> redis.Redis:
+        """
+        client without decode_responses, for binary values
+        """
+        if self._raw_client is None:
+            self._raw_client = redis.Redis(connection_pool=self.pool(decode_responses=False))
+        return self._raw_client
+
+    def pool(self, decode_responses: bool = True) -> MeteredConnectionPool:
+        key = (self.host, self.port, self.db_name, decode_responses)
+        if key not in self._pools:
+            with self._lock:
+                if key not in self._pools:
+                    self._pools[key] = MeteredConnectionPool(
+                        host=self.host,
+                        port=self.port,
+                        password=self.password or None,
+                        db=self.db_name,
+                        decode_responses=decode_responses,
+                        max_connections=REDIS_MAX_CONNECTIONS,
+                        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                        socket_timeout=REDIS_SOCKET_TIMEOUT,
+                        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+                        socket_keepalive=True,
+                    )
+        return self._pools[key]
+
+    @classmethod
+    def pool_stats(cls) -> List[Dict]:
+        return [dict(pool.stats(), host=host, port=port, db=db, decode_responses=decode)
+                for (host, port, db, decode), pool in list(cls._pools.items())]
+
+    def _listen(self) -> None:
+        """
+        keep one invalidation subscriber thread per process, restarted if it died
+        """
+        subscriber = RedisClient._subscriber
+        if subscriber is not None and subscriber.is_alive():
+            return
+        with self._lock:
+            subscriber = RedisClient._subscriber
+            if subscriber is not None and subscriber.is_alive():
+                return
+            # entries may have missed invalidations while no one was listening
+            self._local.clear()
+
+            def handler(message):
+                try:
+                    names = json.loads(message['data'])
+                except (TypeError, json.JSONDecodeError):
+                    return
+                RedisClient._drop(names)
+
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATE_CHANNEL: handler})
+            RedisClient._subscriber = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def cached(self, name: str, command: Union[str, Callable], *args, ttl: float = None) -> Any:
+        """
+        read through local cache
+        command: redis command called as command(name, *args), or a loader called as loader(*args)
+        whatever it reads must be invalidated by name on write
+        """
+        try:
+            self._listen()
+        except redis.RedisError as e:
+            logger.error(f'REDIS SUBSCRIBE ERR [{e}]')
+            return self._load(name, command, *args)
+        sub = (command if isinstance(command, str) else command.__qualname__, args)
+        entry = self._local.get(name)
+        if entry is not None and sub in entry:
+            return entry[sub]
+        epoch = RedisClient._epoch
+        value = self._load(name, command, *args)
+        if epoch != RedisClient._epoch:
+            return value
+        # copy on write, entries are shared between threads
+        entry = dict(entry or {})
+        entry[sub] = value
+        self._local.set(name, entry, ttl)
+        return value
+
+    def _load(self, name: str, command: Union[str, Callable], *args) -> Any:
+        if isinstance(command, str):
+            return getattr(self.redis_client, command)(name, *args)
+        return command(*args)
+
+    @classmethod
+    def _drop(cls, names) -> None:
+        cls._epoch += 1
+        for name in names:
+            cls._local.delete(name)
+
+    def invalidate(self, *names: str) -> None:
+        RedisClient._drop(names)
+        if names:
+            self.redis_client.publish(INVALIDATE_CHANNEL, json.dumps(names))
+
+    def encode(self, obj: Any) -> bytes:
+        return self.codec.encode(obj)
+
+    def decode(self, data: Union[bytes, str, None]) -> Any:
+        return self.codec.decode(data)
 
     def set(self, key, data, ex=None, nx=False):
         self.redis_client.set(key, data, ex=ex, nx=nx)
@@ -49,6 +255,7 @@ class RedisClient:
 
     def hash_set(self, name, key, val):
         self.redis_client.hset(name, key, val)
+        self.invalidate(name)
 
     def hash_get(self, name, key):
         return self.redis_client.hget(name, key)
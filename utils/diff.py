@@ -0,0 +1,127 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from utils.cache import LRUCache
+from settings import DIFF_BLOCK_LINES, DIFF_CACHE_SIZE
+
+# (tag, old start, old end, new start, new end), absolute line numbers as difflib opcodes
+Hunk = Tuple[str, int, int, int, int]
+
+
+class TextDiff:
+    """
+    line diff computed block by block, only the blocks that are viewed or scanned are matched
+    blocks are cut every block_lines of old text, the cut in new text is placed by anchors:
+    lines unique in both texts kept in order (one pass over line hashes), interpolated in between
+    translated documents rarely share lines, then it falls back to the line count ratio
+    """
+
+    def __init__(self, old_text: str, new_text: str, block_lines: int = DIFF_BLOCK_LINES):
+        self.old = old_text.splitlines()
+        self.new = new_text.splitlines()
+        self.block_lines = block_lines
+        self.blocks = max(1, -(-len(self.old) // block_lines))
+        self.size = len(old_text) + len(new_text)
+        self._hunks: Dict[int, List[Hunk]] = {}
+        anchors = self.anchors(self.old, self.new)
+        self._cuts = [0] + [self.align(anchors, i * block_lines) for i in range(1, self.blocks)] + [len(self.new)]
+
+    @staticmethod
+    def anchors(old: List[str], new: List[str]) -> List[Tuple[int, int]]:
+        """
+        (old line, new line) of common head and tail, and of lines unique in both texts in between,
+        longest increasing run of them
+        """
+        head = 0
+        while head < min(len(old), len(new)) and old[head] == new[head]:
+            head += 1
+        tail = 0
+        while tail < min(len(old), len(new)) - head and old[-tail - 1] == new[-tail - 1]:
+            tail += 1
+        old_end, new_end = len(old) - tail, len(new) - tail
+        old, new = old[head:old_end], new[head:new_end]
+        old_count, new_count = Counter(old), Counter(new)
+        new_index = {line: j for j, line in enumerate(new) if new_count[line] == 1}
+        pairs = [(head + i, head + new_index[line]) for i, line in enumerate(old)
+                 if old_count[line] == 1 and line in new_index]
+        # patience sorting, tails[k] is the pair index ending the best run of length k + 1
+        tails, parents, tail_values = [], [-1] * len(pairs), []
+        for index, (_, j) in enumerate(pairs):
+            k = bisect_left(tail_values, j)
+            parents[index] = tails[k - 1] if k else -1
+            if k == len(tails):
+                tails.append(index)
+                tail_values.append(j)
+            else:
+                tails[k] = index
+                tail_values[k] = j
+        run, index = [], tails[-1] if tails else -1
+        while index != -1:
+            run.append(pairs[index])
+            index = parents[index]
+        return [(0, 0), (head, head)] + run[::-1] + [(old_end, new_end), (old_end + tail, new_end + tail)]
+
+    @staticmethod
+    def align(anchors: List[Tuple[int, int]], line: int) -> int:
+        """
+        new line matching old line, exact at anchors, linear between them
+        """
+        k = bisect_right(anchors, (line, float('inf')))
+        if k == len(anchors):
+            return anchors[-1][1]
+        (i1, j1), (i2, j2) = anchors[k - 1], anchors[k]
+        return j1 + round((line - i1) * (j2 - j1) / (i2 - i1)) if i2 > i1 else j1
+
+    def bounds(self, index: int) -> Tuple[int, int, int, int]:
+        old_start = index * self.block_lines
+        old_end = len(self.old) if index == self.blocks - 1 else (index + 1) * self.block_lines
+        new_start, new_end = self._cuts[index], max(self._cuts[index], self._cuts[index + 1])
+        return old_start, old_end, new_start, new_end
+
+    def hunks(self, index: int) -> List[Hunk]:
+        hunks = self._hunks.get(index)
+        if hunks is None:
+            old_start, old_end, new_start, new_end = self.bounds(index)
+            matcher = SequenceMatcher(None, self.old[old_start:old_end], self.new[new_start:new_end], autojunk=False)
+            hunks = [(tag, i1 + old_start, i2 + old_start, j1 + new_start, j2 + new_start)
+                     for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+            self._hunks[index] = hunks
+        return hunks
+
+    def changed(self, index: int) -> bool:
+        return any(tag != 'equal' for tag, *_ in self.hunks(index))
+
+    def page(self, index: int) -> Tuple[str, str]:
+        """
+        old and new text of one block, for diff viewer
+        """
+        old_start, old_end, new_start, new_end = self.bounds(index)
+        return '\n'.join(self.old[old_start:old_end]), '\n'.join(self.new[new_start:new_end])
+
+    def next_change(self, index: int) -> Optional[int]:
+        for i in range(index + 1, self.blocks):
+            if self.changed(i):
+                return i
+        return None
+
+    def prev_change(self, index: int) -> Optional[int]:
+        for i in range(min(index, self.blocks) - 1, -1, -1):
+            if self.changed(i):
+                return i
+        return None
+
+
+# record -> TextDiff, shared by every session, bounded by text size
+DIFF_CACHE = LRUCache(DIFF_CACHE_SIZE, sizeof=lambda diff: diff.size)
+
+
+def get_diff(key: Hashable) -> Optional[TextDiff]:
+    return DIFF_CACHE.get(key)
+
+
+def set_diff(key: Hashable, old_text: str, new_text: str) -> TextDiff:
+    diff = TextDiff(old_text, new_text)
+    DIFF_CACHE.set(key, diff)
+    return diff
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from utils.db import RedisClient
+from utils.parser import Source, XlsxStreamParser
+from settings import GLOSSARY_LEGACY_BLOB
+
+APP_CODE = os.getenv('BKPAAS_APP_ID')
+APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
+
+
+class Glossary:
+    """
+    term:{project}                  hash, glossary name -> whole {source: target} json, read by the backend
+    term:{project}:meta             hash, glossary name -> meta json {user, time, format}
+    term:{project}:entry:{name}     hash, source -> target
+    term:{project}:version          hash, glossary name -> version, bumped on every change
+    glossaries only in term:{project} are copied into entry hash on first read, the blob is kept
+    """
+    CHUNK_SIZE = 1000
+    FORMAT = 'kv'
+
+    def __init__(self, rc: RedisClient, project: str):
+        self.rc = rc
+        self.project = project
+        self.key = f'{APP_CODE}:{APP_ENV}:term:{project}'
+        self.meta_key = f'{self.key}:meta'
+        self.version_key = f'{self.key}:version'
+
+    def entry_key(self, name: str) -> str:
+        return f'{self.key}:entry:{name}'
+
+    @staticmethod
+    def read_xlsx(data: Source) -> Iterator[Tuple[str, str]]:
+        """
+        first sheet, first non empty row is header, column A source, column B target
+        """
+        sheet, header = None, True
+        for title, _, row in XlsxStreamParser.rows(data):
+            if row is None:
+                if sheet is not None:
+                    return
+                sheet = title
+                continue
+            if header:
+                header = not any(col is not None and str(col).strip() != '' for col in row)
+                continue
+            if not row or row[0] is None or str(row[0]).strip() == '':
+                continue
+            yield str(row[0]), '' if len(row) < 2 or row[1] is None else str(row[1])
+
+    def names(self) -> List[str]:
+        """
+        every write of meta key invalidates key too, so both are cached under key
+        """
+        return self.rc.cached(self.key, self._names)
+
+    def _names(self) -> List[str]:
+        # legacy blobs only live in key, without GLOSSARY_LEGACY_BLOB new imports only in meta key
+        with self.rc.redis_client.pipeline(transaction=False) as pipe:
+            pipe.hkeys(self.key)
+            pipe.hkeys(self.meta_key)
+            legacy, names = pipe.execute()
+        return list(dict.fromkeys(legacy + names))
+
+    def exists(self, name: str) -> bool:
+        with self.rc.redis_client.pipeline(transaction=False) as pipe:
+            pipe.hexists(self.key, name)
+            pipe.hexists(self.meta_key, name)
+            return any(pipe.execute())
+
+    def meta(self, name: str) -> Dict:
+        """
+        {} if the glossary does not exist
+        """
+        data = self.rc.redis_client.hget(self.meta_key, name)
+        if data is None:
+            return self._copy_legacy(name)
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            return {}
+
+    def _copy_legacy(self, name: str) -> Dict:
+        """
+        fill entry hash from the legacy blob, term:{project} itself is left as is
+        """
+        blob = self.rc.redis_client.hget(self.key, name)
+        if blob is None:
+            return {}
+        try:
+            data = json.loads(blob)
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        rows = ((k, '' if v is None else str(v)) for k, v in data.items())
+        self._write(name, rows, '', blob=False)
+        return json.loads(self.rc.redis_client.hget(self.meta_key, name) or '{}')
+
+    def stats(self, names: List[str]) -> List[Dict]:
+        with self.rc.redis_client.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.hlen(self.entry_key(name))
+                pipe.hget(self.version_key, name)
+            result = pipe.execute()
+        return [{'name': name, 'count': result[i * 2], 'version': int(result[i * 2 + 1] or 0)}
+                for i, name in enumerate(names)]
+
+    def version(self, name: str) -> int:
+        return int(self.rc.redis_client.hget(self.version_key, name) or 0)
+
+    def versions(self, names: List[str]) -> Dict[str, int]:
+        if not names:
+            return {}
+        versions = self.rc.cached(self.version_key, 'hmget', tuple(names))
+        return {name: int(version or 0) for name, version in zip(names, versions)}
+
+    def import_rows(self, name: str, rows: Iterable[Tuple[str, str]], user: str) -> int:
+        """
+        replace the glossary, written in pipelined chunks
+        """
+        return self._write(name, rows, user, blob=GLOSSARY_LEGACY_BLOB)
+
+    def _write(self, name: str, rows: Iterable[Tuple[str, str]], user: str, blob: bool) -> int:
+        client, count, entries = self.rc.redis_client, 0, {}
+        tmp_key = f'{self.entry_key(name)}:importing'
+        client.delete(tmp_key)
+        rows = iter(rows)
+        while True:
+            chunk = dict(islice(rows, self.CHUNK_SIZE))
+            if not chunk:
+                break
+            with client.pipeline(transaction=False) as pipe:
+                pipe.hset(tmp_key, mapping=chunk)
+                pipe.execute()
+            if blob:
+                entries.update(chunk)
+            count += len(chunk)
+        with client.pipeline(transaction=True) as pipe:
+            if count:
+                pipe.rename(tmp_key, self.entry_key(name))
+            else:
+                pipe.delete(self.entry_key(name))
+            if blob:
+                pipe.hset(self.key, name, json.dumps(entries))
+            pipe.hset(self.meta_key, name, json.dumps({'user': user, 'time': int(time.time()), 'format': self.FORMAT}))
+            pipe.hincrby(self.version_key, name, 1)
+            pipe.execute()
+        self.rc.invalidate(self.key, self.version_key)
+        return count
+
+    def _sync_blob(self, name: str) -> None:
+        """
+        keep the blob the backend reads in step with entry hash
+        """
+        if GLOSSARY_LEGACY_BLOB:
+            self.rc.redis_client.hset(self.key, name, json.dumps(self.rc.redis_client.hgetall(self.entry_key(name))))
+
+    def add(self, name: str, entries: Dict[str, str]) -> None:
+        self.meta(name)
+        with self.rc.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.entry_key(name), mapping=entries)
+            pipe.hincrby(self.version_key, name, 1)
+            pipe.execute()
+        self._sync_blob(name)
+        self.rc.invalidate(self.key, self.version_key)
+
+    def remove(self, name: str, sources: List[str]) -> int:
+        self.meta(name)
+        with self.rc.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hdel(self.entry_key(name), *sources)
+            pipe.hincrby(self.version_key, name, 1)
+            removed = pipe.execute()[0]
+        if removed:
+            self._sync_blob(name)
+        self.rc.invalidate(self.key, self.version_key)
+        return removed
+
+    def delete(self, name: str) -> None:
+        with self.rc.redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.entry_key(name))
+            pipe.hdel(self.key, name)
+            pipe.hdel(self.meta_key, name)
+            pipe.hdel(self.version_key, name)
+            pipe.execute()
+        self.rc.invalidate(self.key, self.version_key)
+
+    def entries(self, name: str) -> Dict[str, str]:
+        self.meta(name)
+        return self.rc.redis_client.hgetall(self.entry_key(name))
+
+    def sources(self, name: str) -> List[str]:
+        self.meta(name)
+        return self.rc.redis_client.hkeys(self.entry_key(name))
+
+    def targets(self, name: str, sources: List[str]) -> Dict[str, str]:
+        """
+        current target of each source, removed ones are left out
+        """
+        if not sources:
+            return {}
+        targets = self.rc.redis_client.hmget(self.entry_key(name), sources)
+        return {source: target for source, target in zip(sources, targets) if target is not None}
+
+    def page(self, name: str, cursor: int = 0, count: int = 50) -> Tuple[int, Dict[str, str]]:
+        """
+        one hscan step, next cursor 0 means the end
+        """
+        if cursor == 0:
+            self.meta(name)
+        return self.rc.redis_client.hscan(self.entry_key(name), cursor, count=count)
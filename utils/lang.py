@@ -0,0 +1,63 @@
+import hashlib
+import threading
+
+from langdetect import DetectorFactory, detect
+from langdetect.detector_factory import init_factory
+from langdetect.lang_detect_exception import LangDetectException
+
+from utils.cache import LRUCache
+from log import logger
+from settings import LANG_DETECT_SEED, LANG_SAMPLE_SIZE, LANG_CACHE_SIZE
+
+# same text, same answer
+DetectorFactory.seed = LANG_DETECT_SEED
+
+
+class LanguageDetector:
+    """
+    langdetect with profiles loaded once per process, detection on a bounded sample
+    memoized by text hash, shared by every session and rerun
+    """
+    UNKNOWN = 'unknown'
+    SAMPLE_WINDOWS = 4
+    cache = LRUCache(LANG_CACHE_SIZE, sizeof=lambda _: 1)
+    _lock = threading.Lock()
+    _ready = threading.Event()
+
+    @classmethod
+    def warm(cls) -> None:
+        """
+        load every language profile, about a second, so run it in background at import
+        """
+        with cls._lock:
+            if not cls._ready.is_set():
+                init_factory()
+                cls._ready.set()
+
+    @classmethod
+    def sample(cls, text: str, size: int = LANG_SAMPLE_SIZE) -> str:
+        """
+        a few windows spread over the text instead of the head only, headers are often english
+        """
+        if len(text) <= size:
+            return text
+        width = size // cls.SAMPLE_WINDOWS
+        step = (len(text) - width) // (cls.SAMPLE_WINDOWS - 1)
+        return '\n'.join(text[i * step:i * step + width] for i in range(cls.SAMPLE_WINDOWS))
+
+    @classmethod
+    def detect(cls, text: str) -> str:
+        key = hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest()
+        language = cls.cache.get(key)
+        if language is None:
+            cls.warm()
+            try:
+                language = detect(cls.sample(text))
+            except LangDetectException as e:
+                logger.info(f'LANG DETECT ERR [{e}]')
+                language = cls.UNKNOWN
+            cls.cache.set(key, language)
+        return language
+
+
+threading.Thread(target=LanguageDetector.warm, daemon=True).start()
@@ -0,0 +1,149 @@
+import threading
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from utils.cache import LRUCache
+from utils.glossary import Glossary
+from log import logger
+from settings import TERM_MATCHER_CACHE_STATES
+
+# (project, glossary name) -> (version, automaton), one version per glossary, bounded by states
+_AUTOMATONS = LRUCache(TERM_MATCHER_CACHE_STATES, sizeof=lambda item: len(item[1].goto))
+# (project, glossary name) -> (version, automaton) for automatons larger than the whole cache,
+# kept here instead of being rebuilt on every request
+_OVERSIZED: Dict[Tuple[str, str], Tuple[int, 'AhoCorasick']] = {}
+_OVERSIZED_LOCK = threading.Lock()
+# (project, glossary name) being rebuilt in background
+_BUILDING = set()
+_BUILDING_LOCK = threading.Lock()
+
+
+class AhoCorasick:
+    """
+    multi pattern matcher, one linear pass over text
+    """
+
+    def __init__(self, patterns: Iterable[str], ignore_case: bool = True):
+        self.ignore_case = ignore_case
+        self.patterns: List[str] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[int]] = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        key = pattern.lower() if self.ignore_case else pattern
+        if not key:
+            return
+        state = 0
+        for char in key:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            state = nxt
+        self.out[state].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(char, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, str]]:
+        """
+        (end position, pattern) for every occurrence
+        """
+        if self.ignore_case:
+            text = text.lower()
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for index in self.out[state]:
+                yield i, self.patterns[index]
+
+    def findall(self, text: str) -> Set[str]:
+        return {pattern for _, pattern in self.iter(text)}
+
+
+class TermMatcher:
+    """
+    only send the glossary entries that occur in the text
+    automatons only hold sources, targets are read from the entry hash for the matched ones,
+    so removed or edited entries are right at once
+    after a change the previous automaton keeps serving while the new one is built in background,
+    added entries are matched once it is swapped in
+    """
+
+    def __init__(self, glossary: Glossary):
+        self.glossary = glossary
+
+    def build(self, name: str, version: int) -> AhoCorasick:
+        automaton = AhoCorasick(self.glossary.sources(name))
+        key = (self.glossary.project, name)
+        current = self.cached(key)
+        if current is not None and current[0] >= version:
+            return automaton
+        if len(automaton.goto) > TERM_MATCHER_CACHE_STATES:
+            logger.warning(f'TERM MATCHER OVERSIZED [{key} {len(automaton.goto)} states > '
+                           f'TERM_MATCHER_CACHE_STATES {TERM_MATCHER_CACHE_STATES}]')
+            with _OVERSIZED_LOCK:
+                _OVERSIZED[key] = (version, automaton)
+            _AUTOMATONS.delete(key)
+        else:
+            _AUTOMATONS.set(key, (version, automaton))
+            with _OVERSIZED_LOCK:
+                _OVERSIZED.pop(key, None)
+        return automaton
+
+    @staticmethod
+    def cached(key: Tuple[str, str]) -> Optional[Tuple[int, AhoCorasick]]:
+        item = _AUTOMATONS.get(key)
+        if item is None:
+            with _OVERSIZED_LOCK:
+                item = _OVERSIZED.get(key)
+        return item
+
+    def _rebuild(self, name: str, version: int) -> None:
+        key = (self.glossary.project, name)
+        try:
+            self.build(name, version)
+        except Exception as e:
+            logger.error(f'TERM MATCHER BUILD ERR [{key} {e}]')
+        finally:
+            with _BUILDING_LOCK:
+                _BUILDING.discard(key)
+
+    def automaton(self, name: str, version: int) -> AhoCorasick:
+        key = (self.glossary.project, name)
+        item = self.cached(key)
+        if item is None:
+            return self.build(name, version)
+        if item[0] < version:
+            with _BUILDING_LOCK:
+                start = key not in _BUILDING
+                _BUILDING.add(key)
+            if start:
+                threading.Thread(target=self._rebuild, args=(name, version), daemon=True).start()
+        return item[1]
+
+    def match(self, names: List[str], text: str) -> Dict[str, str]:
+        result = {}
+        for name, version in self.glossary.versions(names).items():
+            automaton = self.automaton(name, version)
+            result.update(self.glossary.targets(name, sorted(automaton.findall(text))))
+        return result
@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.db import RedisClient
+from utils.cache import LRUCache, SingleFlight
+from settings import TM_TTL, TEXT_CACHE_SIZE, TEXT_CACHE_TTL
+
+APP_CODE = os.getenv('BKPAAS_APP_ID')
+APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
+
+# process wide, shared by every session and rerun (streamlit re-executes app.py, not imported modules)
+TEXT_CACHE = LRUCache(TEXT_CACHE_SIZE, ttl=TEXT_CACHE_TTL, sizeof=lambda _: 1)
+TEXT_FLIGHT = SingleFlight()
+
+
+class TranslationMemory:
+    """
+    segment translation cache
+    key: model, target language, hash of project and active terms, normalized source text
+    glossaries are per project, so the project is part of the hash whenever terms are used
+    every hit refreshes the ttl, so cold entries expire first
+    """
+
+    def __init__(self, rc: RedisClient, ttl: int = TM_TTL):
+        self.rc = rc
+        self.ttl = ttl
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        only NFC and trailing spaces, line breaks and inner spacing are kept in the translation
+        """
+        text = unicodedata.normalize('NFC', text)
+        return '\n'.join(line.rstrip() for line in text.splitlines()).strip()
+
+    @staticmethod
+    def term_hash(project: str, terms: Iterable[str]) -> str:
+        terms = sorted(terms or [])
+        return hashlib.sha1(json.dumps([project] + terms if terms else []).encode()).hexdigest()[:16]
+
+    def key(self, project: str, model: str, language: str, terms: Iterable[str], text: str) -> str:
+        digest = hashlib.sha1(self.normalize(text).encode()).hexdigest()
+        return f'{APP_CODE}:{APP_ENV}:tm:{model}:{language}:{self.term_hash(project, terms)}:{digest}'
+
+    def stats_key(self, project: str) -> str:
+        return f'{APP_CODE}:{APP_ENV}:tm:stats:{project}'
+
+    def get_many(self, project: str, model: str, language: str,
+                 terms: Iterable[str], texts: List[str]) -> List[Optional[str]]:
+        if not texts:
+            return []
+        keys = [self.key(project, model, language, terms, text) for text in texts]
+        with self.rc.redis_client.pipeline(transaction=False) as pipe:
+            pipe.mget(keys)
+            for key in keys:
+                pipe.expire(key, self.ttl)
+            result = pipe.execute()[0]
+            hits = sum(1 for item in result if item is not None)
+            pipe.hincrby(self.stats_key(project), 'hits', hits)
+            pipe.hincrby(self.stats_key(project), 'misses', len(keys) - hits)
+            pipe.execute()
+        return result
+
+    def get(self, project: str, model: str, language: str, terms: Iterable[str], text: str) -> Optional[str]:
+        return self.get_many(project, model, language, terms, [text])[0]
+
+    def set_many(self, project: str, model: str, language: str, terms: Iterable[str],
+                 pairs: List[Tuple[str, str]]) -> None:
+        with self.rc.redis_client.pipeline(transaction=False) as pipe:
+            for source, target in pairs:
+                pipe.set(self.key(project, model, language, terms, source), target, ex=self.ttl)
+            pipe.execute()
+
+    def set(self, project: str, model: str, language: str, terms: Iterable[str], source: str, target: str) -> None:
+        self.set_many(project, model, language, terms, [(source, target)])
+
+    def stats(self, project: str) -> Dict:
+        data = self.rc.redis_client.hgetall(self.stats_key(project))
+        hits, misses = int(data.get('hits', 0)), int(data.get('misses', 0))
+        return {'hits': hits, 'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
@@ -1,34 +1,188 @@
 import io
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import zipfile
+from xml.etree import ElementTree
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Union
 
-import pandas as pd
-import numpy as np
-from PyPDF2 import PdfReader
-from docx import Document
+from log import logger
+from settings import (
+    PARSER_STREAM, PDF_WORKERS, PDF_CHUNK_PAGES,
+    PARSE_CACHE_SIZE, PARSE_CACHE_REDIS, PARSE_CACHE_TTL
+)
+from utils.cache import LRUCache
+
+APP_CODE = os.getenv('BKPAAS_APP_ID')
+APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
+# bump when parser output changes, old cache entries are ignored
+PARSER_VERSION = '1'
+
+_PDF_POOL = None
+_PDF_POOL_LOCK = threading.Lock()
+# parsers take raw bytes or a seekable binary file (e.g. spooled download buffer)
+Source = Union[bytes, BinaryIO]
+# (filetype, stream) -> parser class, heavy backends are imported inside parser on first use
+PARSERS: Dict = {}
+
+
+def register(filetype: str, stream: bool = False) -> Callable:
+    def deco(cls):
+        PARSERS[(filetype, stream)] = cls
+        return cls
+    return deco
+
+
+def _stream(data: Source) -> BinaryIO:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(data)
+    data.seek(0)
+    return data
+
+
+def _read(data: Source) -> bytes:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data)
+    return _stream(data).read()
+
+
+def _pdf_pool() -> ProcessPoolExecutor:
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        with _PDF_POOL_LOCK:
+            if _PDF_POOL is None:
+                # fork would copy the lock state of server, poller and pub/sub threads into workers
+                _PDF_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS or None,
+                                                mp_context=multiprocessing.get_context('spawn'))
+    return _PDF_POOL
+
+
+def _drop_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    a crashed worker (e.g. OOM kill) breaks the executor for good, next parse creates a new one
+    """
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is pool:
+            _PDF_POOL = None
+    pool.shutdown(wait=False)
+
+
+def _extract_pdf_pages(source: Union[str, BinaryIO], start: int, stop: int) -> List[str]:
+    from PyPDF2 import PdfReader
+
+    pdf_reader = PdfReader(source)
+    return [pdf_reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+class Segment:
+    """
+    a piece of text with its location in source document
+    kind: cell(sheet/row/col or table/row/col), paragraph, page, slide(page), lines(start/end)
+    """
+    __slots__ = ('text', 'kind', 'sheet', 'table', 'page', 'paragraph', 'row', 'col', 'start', 'end')
+
+    def __init__(self, text: str, kind: str, sheet: str = None, table: int = None, page: int = None,
+                 paragraph: int = None, row: int = None, col: int = None, start: int = None, end: int = None):
+        self.text = text
+        self.kind = kind
+        self.sheet = sheet
+        self.table = table
+        self.page = page
+        self.paragraph = paragraph
+        self.row = row
+        self.col = col
+        self.start = start
+        self.end = end
+
+    @property
+    def location(self) -> Dict:
+        return {k: getattr(self, k) for k in self.__slots__[2:] if getattr(self, k) is not None}
+
+    def __repr__(self):
+        return f'Segment({self.kind}, {self.location}, {self.text[:20]!r})'
+
+
+class ParseCache:
+    """
+    parsed text keyed by (sha256 of bytes, extract type, parser version)
+    local lru first, then redis if enabled
+    """
+
+    def __init__(self, max_size: int = PARSE_CACHE_SIZE, redis: bool = PARSE_CACHE_REDIS):
+        self.local = LRUCache(max_size)
+        self.redis = redis
+        self.redis_hits = 0
+        self._rc = None
+
+    @property
+    def rc(self):
+        if self._rc is None:
+            from utils.db import RedisClient
+            self._rc = RedisClient(env="prod")
+        return self._rc
+
+    @staticmethod
+    def key(data: Source, extract_type: str, version: str) -> str:
+        digest = hashlib.sha256()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            digest.update(data)
+        else:
+            stream = _stream(data)
+            for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return f'{version}:{extract_type}:{digest.hexdigest()}'
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.local.get(key)
+        if text is not None or not self.redis:
+            return text
+        try:
+            text = self.rc.redis_client.get(f'{APP_CODE}:{APP_ENV}:parse:{key}')
+        except Exception as e:
+            logger.error(f'PARSE CACHE GET ERR [{e}]')
+            return None
+        if text is not None:
+            self.redis_hits += 1
+            self.local.set(key, text)
+        return text
+
+    def set(self, key: str, text: str) -> None:
+        self.local.set(key, text)
+        if self.redis:
+            try:
+                self.rc.set(f'{APP_CODE}:{APP_ENV}:parse:{key}', text, ex=PARSE_CACHE_TTL)
+            except Exception as e:
+                logger.error(f'PARSE CACHE SET ERR [{e}]')
+
+    @property
+    def stats(self):
+        stats = self.local.stats
+        stats.update({'redis_hits': self.redis_hits,
+                      'misses': stats['misses'] - self.redis_hits})
+        return stats
 
 
 class FileParser:
-    FILE_TYPE = (
-        'xlsx',
-        'docx',
-        'txt',
-        'sql',
-        'pdf',
-        'pptx'
-    )
-
-    def __init__(self, filename: str = ''):
+    cache = ParseCache()
+
+    def __init__(self, filename: str = '', stream: bool = PARSER_STREAM):
         self.filename = filename
+        self.stream = stream
         self._filetype = ''
-        if self.filename.endswith('xlsx'):
-            self._filetype = 'xlsx'
-        elif self.filename.endswith('docx'):
-            self._filetype = 'docx'
-        elif self.filename.endswith('pdf'):
-            self._filetype = 'pdf'
-        elif self.filename.endswith('pptx'):
-            self._filetype = 'pptx'
-        elif self.filename.endswith('txt'):
-            self._filetype = 'txt'
+        for filetype in self.file_types():
+            if self.filename.endswith(filetype):
+                self._filetype = filetype
+                break
+
+    @staticmethod
+    def file_types() -> List[str]:
+        return sorted({filetype for filetype, _ in PARSERS})
 
     @property
     def filetype(self):
@@ -38,15 +192,55 @@ class FileParser:
     def filetype(self, value) -> None:
         self._filetype = value
 
-    def tostring(self, data: bytes):
-        return getattr(globals()[f'{self.filetype.title()}Parser'], 'tostring')(data)
+    @property
+    def parser(self):
+        if self.stream and (self.filetype, True) in PARSERS:
+            return PARSERS[(self.filetype, True)]
+        return PARSERS[(self.filetype, False)]
+
+    def cache_key(self, data: Source) -> str:
+        return ParseCache.key(data, self.filetype, f'{PARSER_VERSION}.{self.parser.__name__}')
 
+    def tostring(self, data: Source):
+        key = self.cache_key(data)
+        text = self.cache.get(key)
+        if text is None:
+            text = getattr(self.parser, 'tostring')(data)
+            self.cache.set(key, text)
+        return text
 
+    def iterstring(self, data: Source) -> Iterator[str]:
+        """
+        yield text piece by piece, fallback to whole string for non-stream parser
+        """
+        key = self.cache_key(data)
+        text = self.cache.get(key)
+        if text is not None:
+            yield text
+        elif hasattr(self.parser, 'iterstring'):
+            pieces = []
+            for piece in self.parser.iterstring(data):
+                pieces.append(piece)
+                yield piece
+            self.cache.set(key, ''.join(pieces))
+        else:
+            text = getattr(self.parser, 'tostring')(data)
+            self.cache.set(key, text)
+            yield text
+
+    def segments(self, data: Source) -> Iterator[Segment]:
+        return getattr(self.parser, 'segments')(data)
+
+
+@register('xlsx')
 class XlsxParser:
     @staticmethod
-    def tostring(data: bytes):
+    def tostring(data: Source):
+        import pandas as pd
+        import numpy as np
+
         pure_text = ''
-        sheets = pd.read_excel(data, sheet_name=None)
+        sheets = pd.read_excel(_stream(data), sheet_name=None)
         for k, v in sheets.items():
             pure_text += k
             for row in v.values.tolist():
@@ -58,31 +252,204 @@ class XlsxParser:
                 pure_text += '\n'
         return pure_text
 
+    @staticmethod
+    def segments(data: Source) -> Iterator[Segment]:
+        return XlsxStreamParser.segments(data)
+
+
+@register('xlsx', stream=True)
+class XlsxStreamParser:
+    """
+    read only mode, keep one row in memory
+    """
+    @staticmethod
+    def rows(data: Source) -> Iterator:
+        """
+        (sheet title, row number, row values), row is None at the beginning of each sheet
+        """
+        from openpyxl import load_workbook
 
+        workbook = load_workbook(_stream(data), read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                yield sheet.title, 0, None
+                # read only mode trusts the <dimension> element, which may be stale, read every row as pandas does
+                sheet.reset_dimensions()
+                # read only iter_rows always starts at A1 whatever the used range is, pin it so row_num holds
+                for row_num, row in enumerate(sheet.iter_rows(min_row=1, min_col=1, values_only=True), 1):
+                    end = len(row)
+                    while end and row[end - 1] is None:
+                        end -= 1
+                    yield sheet.title, row_num, row[:end]
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def iterstring(data: Source) -> Iterator[str]:
+        for title, _, row in XlsxStreamParser.rows(data):
+            if row is None:
+                yield f'{title}\n'
+                continue
+            yield ''.join(' ' if col is None else str(col) for col in row) + '\n'
+
+    @staticmethod
+    def segments(data: Source) -> Iterator[Segment]:
+        for title, row_num, row in XlsxStreamParser.rows(data):
+            if row is None:
+                continue
+            for col_num, col in enumerate(row, 1):
+                if col is None or str(col).strip() == '':
+                    continue
+                yield Segment(str(col), 'cell', sheet=title, row=row_num, col=col_num)
+
+    @staticmethod
+    def tostring(data: Source):
+        buffer = io.StringIO()
+        for line in XlsxStreamParser.iterstring(data):
+            buffer.write(line)
+        return buffer.getvalue()
+
+
+@register('docx')
 class DocxParser:
     @staticmethod
-    def tostring(data: bytes):
-        source_stream = Document(io.BytesIO(data))
+    def tostring(data: Source):
+        from docx import Document
+
+        source_stream = Document(_stream(data))
         return '\n'.join([para.text for para in source_stream.paragraphs])
 
+    @staticmethod
+    def segments(data: Source) -> Iterator[Segment]:
+        from docx import Document
+
+        source_stream = Document(_stream(data))
+        for i, para in enumerate(source_stream.paragraphs):
+            if para.text.strip():
+                yield Segment(para.text, 'paragraph', paragraph=i)
+        for t, table in enumerate(source_stream.tables):
+            for r, row in enumerate(table.rows):
+                seen = set()
+                for c, cell in enumerate(row.cells):
+                    # merged cells are returned once per grid column
+                    if id(cell._tc) in seen or not cell.text.strip():
+                        continue
+                    seen.add(id(cell._tc))
+                    yield Segment(cell.text, 'cell', table=t, row=r, col=c)
 
+
+@register('txt')
 class TxtParser:
     @staticmethod
-    def tostring(data: bytes):
-        return data.decode('utf-8')
+    def tostring(data: Source):
+        return _read(data).decode('utf-8')
+
+    @staticmethod
+    def segments(data: Source) -> Iterator[Segment]:
+        """
+        blocks separated by blank lines, start/end are 1-based line numbers
+        """
+        block, start = [], 0
+        for num, line in enumerate(_read(data).decode('utf-8').splitlines(), 1):
+            if line.strip():
+                if not block:
+                    start = num
+                block.append(line)
+            elif block:
+                yield Segment('\n'.join(block), 'lines', start=start, end=num - 1)
+                block = []
+        if block:
+            yield Segment('\n'.join(block), 'lines', start=start, end=start + len(block) - 1)
 
 
-class SqlParser:
+@register('sql')
+class SqlParser(TxtParser):
     pass
 
 
+@register('pptx')
+class PptxParser:
+    """
+    pptx is a zip of xml, read text runs slide by slide without python-pptx
+    """
+    NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+    @staticmethod
+    def slides(data: Source) -> Iterator[str]:
+        with zipfile.ZipFile(_stream(data)) as archive:
+            names = [name for name in archive.namelist()
+                     if name.startswith('ppt/slides/slide') and name.endswith('.xml')]
+            for name in sorted(names, key=lambda x: int(x[len('ppt/slides/slide'):-len('.xml')])):
+                root = ElementTree.fromstring(archive.read(name))
+                paragraphs = [''.join(run.text or '' for run in para.iter(f'{PptxParser.NS}t'))
+                              for para in root.iter(f'{PptxParser.NS}p')]
+                yield '\n'.join(para for para in paragraphs if para)
+
+    @staticmethod
+    def tostring(data: Source):
+        return '\n'.join(PptxParser.slides(data))
+
+    @staticmethod
+    def segments(data: Source) -> Iterator[Segment]:
+        for i, slide in enumerate(PptxParser.slides(data), 1):
+            if slide.strip():
+                yield Segment(slide, 'slide', page=i)
+
+
 class X16Parser:
     pass
 
 
+@register('pdf')
 class PdfParser:
     @staticmethod
-    def tostring(data: bytes):
-        pdf_reader = PdfReader(io.BytesIO(data))
-        content = [page.extract_text() for page in pdf_reader.pages]
-        return '\n'.join(content)
+    def pages(data: Source) -> Iterator[str]:
+        """
+        page text in order, page ranges are extracted by process pool for large document
+        """
+        from PyPDF2 import PdfReader
+
+        pdf_reader = PdfReader(_stream(data))
+        total = len(pdf_reader.pages)
+        if total <= PDF_CHUNK_PAGES:
+            for page in pdf_reader.pages:
+                yield page.extract_text()
+            return
+        # workers open their own reader, do not keep this one alive while they run
+        del pdf_reader
+        # workers read the document from disk instead of pickling bytes per chunk
+        fd, path = tempfile.mkstemp(suffix='.pdf')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(_stream(data), f)
+            pool, futures = _pdf_pool(), []
+            try:
+                for start in range(0, total, PDF_CHUNK_PAGES):
+                    futures.append(pool.submit(_extract_pdf_pages, path, start,
+                                               min(start + PDF_CHUNK_PAGES, total)))
+                for future in futures:
+                    yield from future.result()
+            except BrokenProcessPool:
+                logger.error('PDF POOL BROKEN, recreated on next parse')
+                _drop_pdf_pool(pool)
+                raise
+            finally:
+                for future in futures:
+                    future.cancel()
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    def segments(data: Source) -> Iterator[Segment]:
+        for i, page in enumerate(PdfParser.pages(data), 1):
+            if page.strip():
+                yield Segment(page, 'page', page=i)
+
+    @staticmethod
+    def iterstring(data: Source) -> Iterator[str]:
+        for i, page in enumerate(PdfParser.pages(data)):
+            yield page if i == 0 else f'\n{page}'
+
+    @staticmethod
+    def tostring(data: Source):
+        return ''.join(PdfParser.iterstring(data))
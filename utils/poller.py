@@ -0,0 +1,177 @@
+import json
+import time
+import uuid
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from api.dolph import AsyncDolphClient
+from utils.db import RedisClient
+from utils.record import RecordStore
+from log import logger
+from settings import (
+    TASK_POLL_INTERVAL, TASK_POLL_MIN_DELAY, TASK_POLL_MAX_DELAY, TASK_POLL_BATCH, TASK_POLL_LOCK_TTL,
+    TASK_POLL_MAX_TRIES, TASK_POLL_MAX_AGE, RECORD_RETENTION_INTERVAL
+)
+
+
+class TaskPoller:
+    """
+    refresh status of pending translate tasks in background, one leader across replicas
+    RecordStore.PENDING_KEY          zset, json [project, username, key] -> next poll time
+    {PENDING_KEY}:tries              hash, member -> polls without status change, for backoff
+    {PENDING_KEY}:leader             lock, owner token with TASK_POLL_LOCK_TTL
+    tasks stuck past TASK_POLL_MAX_TRIES or TASK_POLL_MAX_AGE (e.g. result expired on dolph) end as UNKNOWN
+    the leader also applies record retention to every project/user each RECORD_RETENTION_INTERVAL
+    """
+    _thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+
+    def __init__(self, rc: RedisClient):
+        self.rc = rc
+        self.key = RecordStore.PENDING_KEY
+        self.tries_key = f'{self.key}:tries'
+        self.leader_key = f'{self.key}:leader'
+        self.token = uuid.uuid4().hex
+        self._next_sweep = 0
+        self._sweeper: Optional[threading.Thread] = None
+
+    @classmethod
+    def start(cls, rc: RedisClient) -> None:
+        """
+        one poller thread per process, restarted if it died
+        """
+        if cls._thread is not None and cls._thread.is_alive():
+            return
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive():
+                return
+            cls._thread = threading.Thread(target=cls(rc).run, daemon=True)
+            cls._thread.start()
+
+    @staticmethod
+    def delay(tries: int) -> float:
+        return min(TASK_POLL_MIN_DELAY * 2 ** tries, TASK_POLL_MAX_DELAY)
+
+    def leader(self) -> bool:
+        client = self.rc.redis_client
+        if client.set(self.leader_key, self.token, nx=True, ex=TASK_POLL_LOCK_TTL):
+            return True
+        if client.get(self.leader_key) == self.token:
+            client.expire(self.leader_key, TASK_POLL_LOCK_TTL)
+            return True
+        return False
+
+    def run(self) -> None:
+        while True:
+            try:
+                if self.leader():
+                    self.poll()
+                    self.retain()
+            except redis.RedisError as e:
+                logger.error(f'TASK POLL ERR [{e}]')
+            time.sleep(TASK_POLL_INTERVAL)
+
+    def retain(self) -> None:
+        """
+        sweep in its own thread, archive uploads must not hold up polling or the leader lock
+        """
+        if time.time() < self._next_sweep or (self._sweeper is not None and self._sweeper.is_alive()):
+            return
+        self._next_sweep = time.time() + RECORD_RETENTION_INTERVAL
+        self._sweeper = threading.Thread(target=self.sweep, daemon=True)
+        self._sweeper.start()
+
+    def sweep(self) -> None:
+        """
+        retention of every project/user, also those who stopped uploading
+        """
+        root, suffix = f'{RecordStore.ROOT}:', ':index'
+        try:
+            for index_key in self.rc.redis_client.scan_iter(match=f'{root}*{suffix}', count=1000):
+                project, _, username = index_key[len(root):-len(suffix)].rpartition(':')
+                if project:
+                    RecordStore(self.rc, project, username).apply_retention(background=False)
+        except redis.RedisError as e:
+            logger.error(f'RECORD RETENTION ERR [{e}]')
+
+    def due(self, limit: int = TASK_POLL_BATCH) -> List[Tuple[str, RecordStore, str, Dict, int]]:
+        """
+        (member, store, key, meta, tries) of records to poll now
+        """
+        client = self.rc.redis_client
+        members = client.zrangebyscore(self.key, '-inf', time.time(), start=0, num=limit)
+        records = []
+        for member in members:
+            try:
+                project, username, key = json.loads(member)
+            except (TypeError, ValueError):
+                client.zrem(self.key, member)
+                continue
+            records.append((member, RecordStore(self.rc, project, username), key))
+        if not records:
+            return []
+        with client.pipeline(transaction=False) as pipe:
+            for _, store, key in records:
+                pipe.hgetall(store.meta_key(key))
+            pipe.hmget(self.tries_key, [member for member, _, _ in records])
+            result = pipe.execute()
+        metas, tries = result[:-1], result[-1]
+        return [(member, store, key, meta, int(tried or 0))
+                for (member, store, key), meta, tried in zip(records, metas, tries)]
+
+    @staticmethod
+    def fetch(task_ids: List[str]) -> List[Dict]:
+        async def run():
+            async with AsyncDolphClient() as client:
+                return await asyncio.gather(*[client.request({}, f'task/{task_id}', 'get')
+                                              for task_id in task_ids])
+        return asyncio.run(run())
+
+    def poll(self) -> int:
+        """
+        one batch, returns number of records that reached a terminal status
+        """
+        records = self.due()
+        if not records:
+            return 0
+        polled = [record for record in records if record[3].get('task_id')]
+        responses = self.fetch([meta['task_id'] for _, _, _, meta, _ in polled])
+        statuses = {member: (response.get('data') or {}).get('status') for (member, *_), response
+                    in zip(polled, responses)}
+        now, finished, changed = time.time(), 0, set()
+        with self.rc.redis_client.pipeline(transaction=False) as pipe:
+            for member, store, key, meta, tries in records:
+                status = statuses.get(member)
+                if not meta or not meta.get('task_id') or meta.get('status') in RecordStore.TERMINAL:
+                    # meta deleted, no task id, or stopped from record page
+                    pipe.zrem(self.key, member)
+                    pipe.hdel(self.tries_key, member)
+                    continue
+                if status in RecordStore.TERMINAL:
+                    pipe.hset(store.meta_key(key), 'status', status)
+                    pipe.zrem(self.key, member)
+                    pipe.hdel(self.tries_key, member)
+                    changed.add(store.index_key)
+                    finished += 1
+                    continue
+                if status and status != meta.get('status'):
+                    pipe.hset(store.meta_key(key), 'status', status)
+                    changed.add(store.index_key)
+                    tries = 0
+                else:
+                    tries += 1
+                if tries >= TASK_POLL_MAX_TRIES or now - store.score(key) > TASK_POLL_MAX_AGE:
+                    pipe.hset(store.meta_key(key), 'status', 'UNKNOWN')
+                    pipe.zrem(self.key, member)
+                    pipe.hdel(self.tries_key, member)
+                    changed.add(store.index_key)
+                    continue
+                pipe.hset(self.tries_key, member, tries)
+                pipe.zadd(self.key, {member: now + self.delay(tries)})
+            pipe.execute()
+        if changed:
+            self.rc.invalidate(*changed)
+        return finished
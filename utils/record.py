@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from api.bkrepo import BKRepo
+from utils.db import Codec, RedisClient
+from log import logger
+from exceptions import ActionFailed
+from settings import (
+    RECORD_SEARCH_WINDOW, RECORD_RETENTION_DAYS, RECORD_RETENTION_COUNT, RECORD_RETENTION_PROJECTS, RECORD_RETENTION_INTERVAL,
+    RECORD_ARCHIVE_BATCH_SIZE, RECORD_ARCHIVE_PROJECT, RECORD_ARCHIVE_REPO, RECORD_REHYDRATE_TTL,
+    BK_REPO_SPOOL_SIZE
+)
+
+APP_CODE = os.getenv('BKPAAS_APP_ID')
+APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
+
+
+class RecordStore:
+    """
+    translate records of one project/user
+    {prefix}:index            zset, record key(time) -> timestamp
+    {prefix}:meta:{key}       hash, small fields for list view
+    {prefix}:payload:{key}    RedisClient codec encoded json, the rest (file, pure_text, response...)
+    {prefix}:live             zset like index, only records whose payload is not archived
+    {prefix}:names            hash, record key -> lowercased file name, for search
+    {prefix} was a hash of full json records before, migrated on first access
+    expired payloads are archived to bkrepo in batches, meta fields archive/archive_offset/archive_size
+    locate the payload inside its batch
+    records with a task id and not terminal status are tracked in PENDING_KEY for utils.poller
+    """
+    META_FIELDS = ('file_name', 'extract_type', 'translate_type', 'project', 'status', 'task_id')
+    # UNKNOWN: no task id, or the poller gave up on it
+    TERMINAL = ('SUCCESS', 'FAILURE', 'REVOKED', 'UNKNOWN')
+    ROOT = f'{APP_CODE}:{APP_ENV}:record'
+    # zset, json [project, username, key] -> next poll time
+    PENDING_KEY = f'{ROOT}:pending'
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    # archives are cold, always compressed
+    ARCHIVE_CODEC = Codec(min_size=0)
+    # prefixes already checked for legacy hash in this process
+    _migrated = set()
+
+    def __init__(self, rc: RedisClient, project: str, username: str):
+        self.rc = rc
+        self.project = project
+        self.username = username
+        self.prefix = f'{self.ROOT}:{project}:{username}'
+        self.index_key = f'{self.prefix}:index'
+        self.live_key = f'{self.prefix}:live'
+        self.names_key = f'{self.prefix}:names'
+        self.archive_root = f'record/{APP_ENV}/{project}/{username}'
+        self._raw = None
+
+    @property
+    def raw(self):
+        # payloads are binary, use the pool without decode_responses
+        if self._raw is None:
+            self._raw = self.rc.raw_client
+        return self._raw
+
+    def meta_key(self, key: str) -> str:
+        return f'{self.prefix}:meta:{key}'
+
+    def payload_key(self, key: str) -> str:
+        return f'{self.prefix}:payload:{key}'
+
+    def member(self, key: str) -> str:
+        return json.dumps([self.project, self.username, key])
+
+    def split(self, record: Dict):
+        meta = {k: record[k] for k in self.META_FIELDS if record.get(k) is not None}
+        task_id = (record.get('response') or {}).get('task_id')
+        if task_id and 'task_id' not in meta:
+            meta['task_id'] = task_id
+        meta.setdefault('status', 'PENDING')
+        payload = {k: v for k, v in record.items() if k not in meta}
+        return meta, payload
+
+    @staticmethod
+    def score(key: str) -> float:
+        try:
+            return time.mktime(time.strptime(key, RecordStore.TIME_FORMAT))
+        except ValueError:
+            return time.time()
+
+    def add(self, key: str, record: Dict) -> None:
+        meta, payload = self.split(record)
+        with self.raw.pipeline(transaction=True) as pipe:
+            pipe.hset(self.meta_key(key), mapping={k: str(v) for k, v in meta.items()})
+            pipe.set(self.payload_key(key), self.rc.encode(payload))
+            pipe.zadd(self.index_key, {key: self.score(key)})
+            pipe.zadd(self.live_key, {key: self.score(key)})
+            pipe.hset(self.names_key, key, str(meta.get('file_name', '')).lower())
+            if meta.get('task_id') and meta['status'] not in self.TERMINAL:
+                pipe.zadd(self.PENDING_KEY, {self.member(key): time.time()})
+            pipe.execute()
+        self.rc.invalidate(self.index_key)
+
+    def count(self) -> int:
+        self.migrate()
+        return self.rc.cached(self.index_key, 'zcard')
+
+    def list(self, offset: int = 0, limit: int = 10) -> List[Dict]:
+        """
+        newest first, only meta hashes are read
+        cached under index key, so every meta change must invalidate index key
+        """
+        self.migrate()
+        return self.rc.cached(self.index_key, self._list, offset, limit)
+
+    def _list(self, offset: int, limit: int) -> List[Dict]:
+        return self._metas(self.rc.redis_client.zrevrange(self.index_key, offset, offset + limit - 1))
+
+    def _metas(self, keys: Sequence[str]) -> List[Dict]:
+        with self.rc.redis_client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(self.meta_key(key))
+            metas = pipe.execute()
+            # records from before the poller, nx keeps the schedule of tracked ones
+            pending = {self.member(key): time.time() for key, meta in zip(keys, metas)
+                       if meta.get('task_id') and meta.get('status', 'PENDING') not in self.TERMINAL}
+            if pending:
+                pipe.zadd(self.PENDING_KEY, pending, nx=True)
+                pipe.execute()
+        return [dict(meta, time=key) for key, meta in zip(keys, metas)]
+
+    def search(self, text: str) -> List[str]:
+        """
+        newest first, keys of records whose file name contains text, case insensitive
+        only the newest RECORD_SEARCH_WINDOW records are searched, two round trips whatever the history
+        """
+        self.migrate()
+        return self.rc.cached(self.index_key, self._search, text.lower())
+
+    def _search(self, text: str) -> List[str]:
+        client = self.rc.redis_client
+        keys = client.zrevrange(self.index_key, 0, RECORD_SEARCH_WINDOW - 1)
+        if not keys:
+            return []
+        names = client.hmget(self.names_key, keys)
+        missing = [key for key, name in zip(keys, names) if name is None]
+        if missing:
+            # records from before the names hash, filled once
+            with client.pipeline(transaction=False) as pipe:
+                for key in missing:
+                    pipe.hget(self.meta_key(key), 'file_name')
+                filled = dict(zip(missing, ((name or '').lower() for name in pipe.execute())))
+            client.hset(self.names_key, mapping=filled)
+            names = [filled[key] if name is None else name for key, name in zip(keys, names)]
+        return [key for key, name in zip(keys, names) if text in name]
+
+    def search_page(self, text: str, offset: int = 0, limit: int = 10) -> List[Dict]:
+        keys = self.search(text)[offset:offset + limit]
+        return self.rc.cached(self.index_key, self._metas, tuple(keys))
+
+    def get_meta(self, key: str) -> Dict:
+        return self.rc.redis_client.hgetall(self.meta_key(key))
+
+    def get(self, key: str) -> Dict:
+        meta = self.get_meta(key)
+        data = self.raw.get(self.payload_key(key))
+        if data is None and not meta.get('archive'):
+            return meta
+        try:
+            payload = self.rc.decode(data if data is not None else self.rehydrate(key, meta))
+        except Exception as e:
+            logger.error(f'RECORD PAYLOAD ERR [{key} {e}]')
+            payload = {}
+        payload.update(meta)
+        return payload
+
+    def update_meta(self, key: str, **fields) -> None:
+        with self.rc.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.meta_key(key), mapping={k: str(v) for k, v in fields.items()})
+            if 'file_name' in fields:
+                pipe.hset(self.names_key, key, str(fields['file_name']).lower())
+            if fields.get('status') in self.TERMINAL:
+                pipe.zrem(self.PENDING_KEY, self.member(key))
+            pipe.execute()
+        self.rc.invalidate(self.index_key)
+
+    def migrate(self) -> None:
+        """
+        move legacy hash records into meta/payload/index, then drop the hash
+        """
+        if self.prefix in self._migrated:
+            return
+        client = self.rc.redis_client
+        if client.type(self.prefix) != 'hash':
+            self._migrated.add(self.prefix)
+            return
+        for key, value in client.hgetall(self.prefix).items():
+            try:
+                record = json.loads(value)
+            except json.JSONDecodeError:
+                continue
+            self.add(key, record)
+        client.delete(self.prefix)
+        self._migrated.add(self.prefix)
+
+    def retention(self) -> Tuple[int, int]:
+        """
+        (days, count) of this project
+        """
+        policy = RECORD_RETENTION_PROJECTS.get(self.project, {})
+        return int(policy.get('days', RECORD_RETENTION_DAYS)), int(policy.get('count', RECORD_RETENTION_COUNT))
+
+    def expired(self) -> List[str]:
+        """
+        oldest first, records over age or count whose payload is still in redis
+        only live records are read, archived stubs are not visited again
+        """
+        days, count = self.retention()
+        client = self.rc.redis_client
+        self.migrate_live()
+        # newest record out of count, everything up to it is over count
+        over = client.zrevrange(self.index_key, count, count, withscores=True)
+        cutoff = max(time.time() - days * 24 * 3600, over[0][1] if over else float('-inf'))
+        return client.zrangebyscore(self.live_key, '-inf', cutoff)
+
+    def migrate_live(self) -> None:
+        """
+        fill live zset once for records added before it existed
+        """
+        client = self.rc.redis_client
+        if not client.set(f'{self.live_key}:migrated', 1, nx=True):
+            return
+        keys = client.zrange(self.index_key, 0, -1, withscores=True)
+        with client.pipeline(transaction=False) as pipe:
+            for key, _ in keys:
+                pipe.hget(self.meta_key(key), 'archive')
+            archived = pipe.execute()
+        live = {key: score for (key, score), path in zip(keys, archived) if not path}
+        if live:
+            client.zadd(self.live_key, live)
+
+    def archive(self, bk_repo: Optional[BKRepo] = None) -> int:
+        """
+        upload expired payloads in batches of about RECORD_ARCHIVE_BATCH_SIZE bytes, then drop them from redis
+        a batch is compressed payloads back to back, one record is read back by a range request
+        meta hash stays as the stub, so list view and status are untouched
+        """
+        bk_repo = bk_repo or BKRepo()
+        keys, archived = iter(self.expired()), 0
+        key = next(keys, None)
+        while key is not None:
+            offsets = {}
+            with tempfile.SpooledTemporaryFile(max_size=BK_REPO_SPOOL_SIZE) as buffer:
+                while key is not None and buffer.tell() < RECORD_ARCHIVE_BATCH_SIZE:
+                    data = self.raw.get(self.payload_key(key))
+                    if data is not None:
+                        if data[0] not in (Codec.ZLIB, Codec.ZSTD):
+                            data = self.ARCHIVE_CODEC.encode(self.rc.decode(data))
+                        offsets[key] = (buffer.tell(), len(data))
+                        buffer.write(data)
+                    key = next(keys, None)
+                if not offsets:
+                    continue
+                names = list(offsets)
+                # unique per run, a batch that reached bkrepo without its stubs written is never rewritten
+                path = (f'{self.archive_root}/{int(self.score(names[0]))}-{int(self.score(names[-1]))}-'
+                        f'{uuid.uuid4().hex[:12]}.bin')
+                buffer.seek(0)
+                try:
+                    result = bk_repo.upload(RECORD_ARCHIVE_PROJECT, RECORD_ARCHIVE_REPO, path, data=buffer)
+                    if isinstance(result, requests.Response) and not result.ok:
+                        raise ActionFailed
+                except (ActionFailed, requests.RequestException) as e:
+                    logger.error(f'RECORD ARCHIVE ERR [{self.prefix} {path} {e}]')
+                    break
+            with self.raw.pipeline(transaction=True) as pipe:
+                for archived_key, (offset, size) in offsets.items():
+                    pipe.hset(self.meta_key(archived_key),
+                              mapping={'archive': path, 'archive_offset': offset, 'archive_size': size})
+                    pipe.delete(self.payload_key(archived_key))
+                pipe.zrem(self.live_key, *offsets)
+                pipe.execute()
+            archived += len(offsets)
+        if archived:
+            self.rc.invalidate(self.index_key)
+        return archived
+
+    def rehydrate(self, key: str, meta: Dict) -> bytes:
+        """
+        stored payload of an archived record, kept in redis for RECORD_REHYDRATE_TTL
+        """
+        data = BKRepo().download_range(RECORD_ARCHIVE_PROJECT, RECORD_ARCHIVE_REPO, meta['archive'],
+                                       int(meta['archive_offset']), int(meta['archive_size']))
+        self.raw.set(self.payload_key(key), data, ex=RECORD_REHYDRATE_TTL)
+        return data
+
+    def apply_retention(self, background: bool = True) -> None:
+        """
+        at most once per RECORD_RETENTION_INTERVAL for each project/user
+        """
+        if not self.rc.redis_client.set(f'{self.prefix}:retention', 1, nx=True, ex=RECORD_RETENTION_INTERVAL):
+            return
+        if background:
+            threading.Thread(target=self._apply_retention, daemon=True).start()
+        else:
+            self._apply_retention()
+
+    def _apply_retention(self) -> None:
+        try:
+            archived = self.archive()
+        except Exception as e:
+            logger.error(f'RECORD RETENTION ERR [{self.prefix} {e}]')
+            return
+        if archived:
+            logger.info(f'archived {archived} records of {self.prefix}')
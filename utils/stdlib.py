@@ -1,20 +1,80 @@
 import os
 import json
+import time
+from typing import List, Optional
+
+from streamlit.delta_generator import DeltaGenerator
 
 from utils.db import RedisClient
+from utils.parser import FileParser, Source
 
 APP_CODE = os.getenv('BKPAAS_APP_ID')
 APP_ENV = os.getenv('BKPAAS_ENVIRONMENT')
 
 
+PROJECT_KEY = f'{APP_CODE}:{APP_ENV}:project'
+
+
 class Tool:
+    # member index already checked in this process
+    _project_index_ready = False
+
     def __init__(self):
         self.rc = RedisClient(env="prod")
 
+    @staticmethod
+    def member_key(username: str) -> str:
+        """
+        set of project names the user belongs to
+        """
+        return f'{PROJECT_KEY}:member:{username}'
+
+    def migrate_project_index(self) -> None:
+        """
+        one shot, build member index from existing project hash
+        """
+        if Tool._project_index_ready:
+            return
+        marker = f'{PROJECT_KEY}:member:migrated'
+        if not self.rc.redis_client.exists(marker):
+            member_keys = set()
+            with self.rc.redis_client.pipeline(transaction=False) as pipe:
+                for name, item in self.rc.redis_client.hgetall(PROJECT_KEY).items():
+                    try:
+                        members = json.loads(item)['members']
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+                    for member in members:
+                        pipe.sadd(self.member_key(member), name)
+                        member_keys.add(self.member_key(member))
+                pipe.set(marker, int(time.time()))
+                pipe.execute()
+            self.rc.invalidate(*member_keys)
+        Tool._project_index_ready = True
+
+    def add_project(self, project_name: str, members: List[str], creator: str) -> bool:
+        """
+        write project and member index in one transaction, False if name exists
+        """
+        with self.rc.redis_client.pipeline(transaction=True) as pipe:
+            pipe.watch(PROJECT_KEY)
+            if pipe.hexists(PROJECT_KEY, project_name):
+                return False
+            pipe.multi()
+            pipe.hset(PROJECT_KEY, project_name,
+                      json.dumps({'project_name': project_name, 'members': members, 'creator': creator}))
+            for member in members:
+                pipe.sadd(self.member_key(member), project_name)
+            pipe.execute()
+        self.rc.invalidate(PROJECT_KEY, *[self.member_key(member) for member in members])
+        return True
+
     def get_project(self, username: str, key: str = None):
-        projects = self.rc.redis_client.hvals(f'{APP_CODE}:{APP_ENV}:project')
-        if not projects:
+        self.migrate_project_index()
+        names = tuple(sorted(self.rc.cached(self.member_key(username), 'smembers')))
+        if not names:
             return []
+        projects = [item for item in self.rc.cached(PROJECT_KEY, 'hmget', names) if item is not None]
         try:
             for item in projects:
                 item = json.loads(item)
@@ -25,3 +85,16 @@ class Tool:
                         yield item[key]
         except json.JSONDecodeError:
             return []
+
+    @staticmethod
+    def parse_text(parser: FileParser, data: Source, msg: Optional[DeltaGenerator] = None) -> str:
+        """
+        consume parser piece by piece and report progress
+        """
+        pieces, last = [], time.time()
+        for piece in parser.iterstring(data):
+            pieces.append(piece)
+            if msg is not None and time.time() - last > 0.5:
+                msg.info(f'Parsing... {len(pieces)} parts done')
+                last = time.time()
+        return ''.join(pieces)